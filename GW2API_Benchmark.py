@@ -0,0 +1,361 @@
+import GW2API_ItemCrafting as crafting
+import json
+import os
+import io
+import random
+import tempfile
+import threading
+import tracemalloc
+import argparse
+import contextlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from time import monotonic
+
+
+#Offline benchmark for the crafting checker. Builds a synthetic recipe graph, serves it from a local stand-in for the GW2 API
+#(and gw2tp's bulk item list), then runs the same pipeline main() does against it and reports where the time, calls and memory went
+#Usage: python GW2API_Benchmark.py --items 5000 --depth 6 --queries 20 --json results.json
+
+
+#Endpoint names used in the call counts, matched on the path the program asks for
+CONST_ENDPOINTS = ('recipes', 'recipes/search', 'items', 'commerce/prices', 'commerce/listings', 'currencies', 'bulk')
+#The pipeline stages of a search, in the order main() runs them. Each one is timed separately
+#syncRecipeGraph only runs in the graph scenario, the same as --sync-graph
+CONST_PHASES = ('syncCatalogue', 'syncRecipeGraph', 'discoverRecipes', 'lookupCurrencies', 'gatherPrices', 'CostTable', 'rankRecipes', 'printResult')
+
+
+
+#Random recipe graph in the shapes the API hands out
+#   items       = ID : {'id', 'name', 'flags', 'vendor_value'}
+#   recipes     = ID : {'id', 'ingredients', 'output_item_id', 'output_item_count', 'disciplines', 'min_rating'}
+#   prices      = ID : {'id', 'buys', 'sells'}, only for items that can go on the trading post
+#   listings    = ID : {'id', 'buys', 'sells'} order books for the same items, starting at the prices and getting worse level by level
+#   currencies  = ID : {'id', 'name'}
+#Items are split over depth + 1 tiers, tier 0 being raw materials. Every crafted item has a recipe with at least one ingredient from the tier
+#right below it, so the graph really is depth tiers deep. fanIn caps the ingredients per recipe, fanOut is roughly how many recipes each
+#material ends up in, cycles is the share of items that also get a recipe turning something from a higher tier back into them
+#(like refining a weapon back into ingots), and multiOutput is the share of recipes that make more than one of their output
+class SyntheticGraph:
+    def __init__(self, itemCount : int = 2000, depth : int = 5, fanIn : int = 3, fanOut : int = 4, cycles : float = 0.02,
+                 multiOutput : float = 0.2, currencies : float = 0.05, accountBound : float = 0.05, seed : int = 1):
+        rng = random.Random(seed)
+        self.items = {}
+        self.recipes = {}
+        self.prices = {}
+        self.currencies = {1 : {'id' : 1, 'name' : 'Karma'}, 2 : {'id' : 2, 'name' : 'Spirit Shard'}}
+
+        #Tier sizes shrink towards the top, like the real game (lots of materials, fewer finished pieces)
+        weights = [depth + 1 - tier for tier in range(depth + 1)]
+        tiers = []
+        nextID = 1
+        for tier in range(depth + 1):
+            size = max(1, round(itemCount * weights[tier] / sum(weights)))
+            tiers.append(list(range(nextID, nextID + size)))
+            nextID += size
+        self.tiers = tiers
+
+        for tier, IDs in enumerate(tiers):
+            for id in IDs:
+                flags = ['AccountBound'] if tier > 0 and rng.random() < accountBound else []
+                self.items[id] = {'id' : id, 'name' : "Tier {} Item {}".format(tier, id), 'flags' : flags, 'vendor_value' : rng.randint(1, 50) * (tier + 1)}
+
+        value = {id : rng.randint(5, 200) for id in tiers[0]}
+        recipeID = 1
+        for tier in range(1, depth + 1):
+            #Share the tier's ingredient slots over a pool sized so that each material is used about fanOut times
+            below = [id for lower in tiers[:tier] for id in lower]
+            slots = len(tiers[tier]) * (fanIn + 1) / 2
+            pool = rng.sample(below, min(len(below), max(1, round(slots / fanOut))))
+            for id in tiers[tier]:
+                ingredients = {rng.choice(tiers[tier - 1]) : rng.randint(1, 10)}
+                for _ in range(rng.randint(1, fanIn) - 1):
+                    ingredients[rng.choice(pool)] = rng.randint(1, 10)
+                count = rng.randint(2, 5) if rng.random() < multiOutput else 1
+                self._addRecipe(recipeID, ingredients, id, count, tier, rng.choice(list(self.currencies)) if rng.random() < currencies else None)
+                value[id] = sum(value[ingredient] * quantity for ingredient, quantity in ingredients.items()) / count * rng.uniform(0.6, 1.6)
+                recipeID += 1
+
+        #The cycles: something from a higher tier broken back down into a lower-tier item
+        for tier in range(depth):
+            for id in tiers[tier]:
+                if rng.random() < cycles:
+                    source = rng.choice(tiers[rng.randint(tier + 1, depth)])
+                    self._addRecipe(recipeID, {source : 1}, id, rng.randint(1, 3), tier, None)
+                    recipeID += 1
+
+        for id, item in self.items.items():
+            if not item['flags']:
+                sell = max(2, round(value[id]))
+                self.prices[id] = {'id' : id, 'buys' : {'unit_price' : max(1, round(sell * rng.uniform(0.7, 0.95)))}, 'sells' : {'unit_price' : sell}}
+
+        self.listings = {}
+        for id, price in self.prices.items():
+            buy, sell = price['buys']['unit_price'], price['sells']['unit_price']
+            step = max(1, sell // 20)
+            self.listings[id] = {
+                'id' : id,
+                'buys' : [{'listings' : 1, 'unit_price' : buy - step * level, 'quantity' : rng.randint(1, 250)}
+                          for level in range(rng.randint(1, 8)) if buy - step * level > 0],
+                'sells' : [{'listings' : 1, 'unit_price' : sell + step * level, 'quantity' : rng.randint(1, 250)} for level in range(rng.randint(1, 8))]
+            }
+
+        #Which recipes use / make each item, for recipes/search
+        self.usedBy = {}
+        self.madeBy = {}
+        for recipe in self.recipes.values():
+            self.madeBy.setdefault(recipe['output_item_id'], []).append(recipe['id'])
+            for ingredient in recipe['ingredients']:
+                if ingredient['type'] == 'Item':
+                    self.usedBy.setdefault(ingredient['id'], []).append(recipe['id'])
+
+    def _addRecipe(self, recipeID : int, ingredients : dict, outputID : int, count : int, tier : int, currencyID : int):
+        ingredients = [{'type' : 'Item', 'id' : id, 'count' : quantity} for id, quantity in ingredients.items()]
+        if currencyID is not None:
+            ingredients.append({'type' : 'Currency', 'id' : currencyID, 'count' : 100})
+        self.recipes[recipeID] = {'id' : recipeID, 'ingredients' : ingredients, 'output_item_id' : outputID, 'output_item_count' : count,
+                                  'disciplines' : ['Weaponsmith'], 'min_rating' : min(500, tier * 75)}
+
+
+
+#Non-blocking version of the program's token bucket for the fake server: a request that finds it empty gets a 429
+class ServerLimiter(crafting.TokenBucket):
+    def take(self) -> bool:
+        with self.lock:
+            self._refill(monotonic())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+
+#Answers the endpoints the program uses, from the server's graph, and counts every call (and every 429) by endpoint
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status : int, body = None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        graph = server.graph
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        path = url.path
+        if path.startswith('/1/bulk/'):
+            endpoint = 'bulk'
+        else:
+            path = path[len('/v2/'):]
+            endpoint = path if path in CONST_ENDPOINTS else path.rsplit('/', 1)[0]
+
+        with server.countLock:
+            server.calls[endpoint] += 1
+        if endpoint != 'bulk' and not server.limiter.take():
+            with server.countLock:
+                server.limited[endpoint] += 1
+            self._reply(429, {'text' : 'too many requests'})
+            return
+
+        IDs = [int(id) for id in params.get('ids', [''])[0].split(',') if id]
+        single = path.rsplit('/', 1)[1] if '/' in path else ''
+        if endpoint == 'bulk':
+            self._reply(200, {'items' : [[id, item['name']] for id, item in graph.items.items()]})
+        elif path == 'recipes':
+            self._reply(200, [graph.recipes[id] for id in IDs if id in graph.recipes] if IDs else list(graph.recipes))
+        elif path == 'recipes/search':
+            if 'input' in params:
+                self._reply(200, graph.usedBy.get(int(params['input'][0]), []))
+            else:
+                self._reply(200, graph.madeBy.get(int(params['output'][0]), []))
+        elif path in ('items', 'commerce/prices', 'commerce/listings', 'currencies'):
+            table = {'items' : graph.items, 'commerce/prices' : graph.prices, 'commerce/listings' : graph.listings, 'currencies' : graph.currencies}[path]
+            found = [table[id] for id in IDs if id in table]
+            #Same as the real API: 206 if only some of the IDs exist, 404 if none do
+            self._reply(404 if not found else 206 if len(found) < len(IDs) else 200, found if found else {'text' : 'all ids provided are invalid'})
+        elif endpoint == 'items' and single.isdigit() and int(single) in graph.items:
+            self._reply(200, graph.items[int(single)])
+        else:
+            self._reply(404, {'text' : 'no such endpoint'})
+
+
+
+#Starts the fake API on a free local port and points the program at it
+def startFakeAPI(graph : SyntheticGraph, rate : float, burst : int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAPIHandler)
+    server.daemon_threads = True
+    server.graph = graph
+    server.limiter = ServerLimiter(rate, burst)
+    server.calls = Counter()
+    server.limited = Counter()
+    server.countLock = threading.Lock()
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    base = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    crafting.CONST_DEFAULT_LINK = base + 'v2/'
+    crafting.CONST_BULK_LINK = base + '1/bulk/'
+    return server
+
+
+
+#Swaps each pipeline stage for a timed wrapper, so a search run through the program's own code reports where its time went
+#Returns the totals (phase : seconds) and a function that puts the originals back
+def timePhases():
+    totals = Counter()
+    originals = {name : getattr(crafting, name) for name in CONST_PHASES}
+
+    def timed(name, function):
+        def wrapper(*args, **kwargs):
+            start = monotonic()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[name] += monotonic() - start
+        return wrapper
+
+    for name, function in originals.items():
+        if name == 'CostTable':
+            #The class is still needed as a class, so time its constructor (which is where the whole cost pass runs)
+            class TimedCostTable(function):
+                __init__ = timed(name, function.__init__)
+            setattr(crafting, name, TimedCostTable)
+        else:
+            setattr(crafting, name, timed(name, function))
+
+    def restore():
+        for name, function in originals.items():
+            setattr(crafting, name, function)
+    return totals, restore
+
+
+
+#Runs one scenario and measures it: wall time, calls and 429s per endpoint, peak traced memory and the per-phase split
+def measure(name : str, server : ThreadingHTTPServer, run, memory : bool) -> dict:
+    server.calls.clear()
+    server.limited.clear()
+    crafting.metrics.reset()
+    totals, restore = timePhases()
+    if memory:
+        tracemalloc.start()
+    start = monotonic()
+    try:
+        #The program talks a lot. Only the numbers matter here
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+    finally:
+        wall = monotonic() - start
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+        restore()
+
+    return {
+        'scenario' : name,
+        'wall' : round(wall, 4),
+        'calls' : dict(server.calls),
+        'limited' : dict(server.limited),
+        'peakMB' : round(peak / 1e6, 2) if peak is not None else None,
+        'phases' : {phase : round(totals[phase], 4) for phase in CONST_PHASES if phase in totals},
+        #The program's own counters: latencies, waits, lookup hit rates and its finer-grained phases
+        'metrics' : crafting.metrics.summary(),
+    }
+
+
+
+#The three situations worth tracking:
+#   cold    a brand new cache, so every recipe, item and price comes from the API
+#   warm    the same searches again on the same state, with recipes stored and prices still fresh
+#   graph   the full recipe graph synced first (--sync-graph), then the searches with cold prices and no recipes/search at all
+def runBenchmark(graph : SyntheticGraph, queries : list, server : ThreadingHTTPServer, memory : bool) -> list:
+    results = []
+    state = None
+
+    def search():
+        for itemID in queries:
+            crafting.printResult(state, crafting.searchItem(state, itemID, True))
+
+    def cold():
+        nonlocal state
+        state = crafting.loadState(interactive = False)
+        search()
+    results.append(measure('cold', server, cold, memory))
+    results.append(measure('warm', server, search, memory))
+
+    def synced():
+        nonlocal state
+        state.store.commit()
+        crafting.syncRecipeGraph(state.settings, state.store.recipes, state.store.links)
+        crafting.writeFile(state.store)
+        crafting.RecipeGraph.write(state.store.recipes)
+        state = crafting.CrafterState(state.store)
+        search()
+    results.append(measure('graph', server, synced, memory))
+    return results
+
+
+
+def printReport(graph : SyntheticGraph, results : list):
+    print("{} items in {} tiers, {} recipes\n".format(len(graph.items), len(graph.tiers), len(graph.recipes)))
+    for result in results:
+        memory = "{:.2f} MB peak".format(result['peakMB']) if result['peakMB'] is not None else "memory not traced"
+        print("{:<6} {:8.3f} s   {}".format(result['scenario'], result['wall'], memory))
+        calls = ", ".join("{} {}".format(endpoint, count) for endpoint, count in sorted(result['calls'].items()))
+        print("       calls: {}".format(calls or "none"))
+        if result['limited']:
+            print("       429s:  {}".format(", ".join("{} {}".format(endpoint, count) for endpoint, count in sorted(result['limited'].items()))))
+        print("       phases: {}".format(", ".join("{} {:.3f} s".format(phase, seconds) for phase, seconds in result['phases'].items())))
+        waits = result['metrics']['waits']
+        print("       waits: rate limit {:.3f} s, 429 backoff {:.3f} s".format(waits['rateLimit'], waits['backoff']))
+        lookups = result['metrics']['lookups']
+        print("       lookups: {}\n".format(", ".join("{} {}/{} hit".format(table, counts['hits'], counts['hits'] + counts['misses'])
+                                                   for table, counts in sorted(lookups.items())) or "none"))
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the crafting checker offline against a synthetic recipe graph.")
+    parser.add_argument('--items', type = int, default = 2000, help = "number of items in the synthetic graph")
+    parser.add_argument('--depth', type = int, default = 5, help = "number of crafting tiers above the raw materials")
+    parser.add_argument('--fan-in', type = int, default = 3, help = "most ingredients a recipe can have")
+    parser.add_argument('--fan-out', type = int, default = 4, help = "roughly how many recipes each material is used in")
+    parser.add_argument('--cycles', type = float, default = 0.02, help = "share of items that can also be made from a higher tier")
+    parser.add_argument('--multi-output', type = float, default = 0.2, help = "share of recipes that make more than one item")
+    parser.add_argument('--queries', type = int, default = 10, help = "how many raw materials to search for")
+    parser.add_argument('--seed', type = int, default = 1, help = "seed for the graph and the chosen queries")
+    parser.add_argument('--server-rate', type = float, default = 100, help = "requests per second the fake API allows before answering 429")
+    parser.add_argument('--server-burst', type = int, default = 50, help = "burst the fake API allows")
+    parser.add_argument('--client-rate', type = float, default = 500, help = "requests per second the program's own token bucket allows")
+    parser.add_argument('--no-memory', action = 'store_true', help = "skip tracing memory, which slows everything down a little")
+    parser.add_argument('--json', metavar = 'FILE', help = "also write the results as JSON, i.e. to compare runs over time")
+    parser.add_argument('--trace', metavar = 'FILE', help = "write a Chrome trace of every phase and API call to FILE")
+    args = parser.parse_args()
+
+    graph = SyntheticGraph(args.items, args.depth, args.fan_in, args.fan_out, args.cycles, args.multi_output, seed = args.seed)
+    queries = random.Random(args.seed).sample(graph.tiers[0], min(args.queries, len(graph.tiers[0])))
+    server = startFakeAPI(graph, args.server_rate, args.server_burst)
+    crafting.transport.bucket = crafting.TokenBucket(args.client_rate, crafting.CONST_RATE_BURST)
+    crafting.metrics.tracing = bool(args.trace)
+
+    #Everything the program stores goes into a scratch directory, so the real cache is never touched
+    with tempfile.TemporaryDirectory() as scratch:
+        home = os.getcwd()
+        os.chdir(scratch)
+        try:
+            results = runBenchmark(graph, queries, server, not args.no_memory)
+        finally:
+            os.chdir(home)
+    server.shutdown()
+
+    printReport(graph, results)
+    if args.trace:
+        crafting.metrics.writeTrace(args.trace)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({'settings' : vars(args), 'results' : results}, file, indent = 2)
@@ -1,27 +1,507 @@
-import requests
+#Taken before anything else is imported, so that the startup timing report (--timing) covers the imports too
+from time import sleep, monotonic
+startTime = monotonic()
+
+#requests and numpy are the slowest imports by far. They are imported where they are first needed instead, so the prompt comes up without them
 import json
 import pickle
 import math
-from time import sleep
+import os
+import mmap
+import struct
+import sqlite3
+import argparse
+import csv
+import threading
+import codecs
+import zlib
+import hashlib
+from datetime import datetime, timezone
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
 
 
 CONST_DEFAULT_LINK = 'https://api.guildwars2.com/v2/'
+#gw2tp's bulk dumps, where the full list of item names comes from
+CONST_BULK_LINK = 'https://api.gw2tp.com/1/bulk/'
+#The GW2 API gives each client a bucket of 300 requests that replenishes at 5 per second
+CONST_RATE_PER_SECOND = 5
+CONST_RATE_BURST = 300
+#How many recipes/search calls can be in flight at once. They all draw from the same token bucket
+CONST_SEARCH_WORKERS = 8
+#Where the item list (and optionally the recipe information) is stored between runs
+CONST_CACHE_DB = "itemCache.sqlite3"
+#The old pickle cache. If it is still around, it gets moved into the database on the next run
+CONST_CACHE_FILE = "itemList.pickle"
+#Compact memory-mapped copy of the full recipe graph, written by --sync-graph
+CONST_GRAPH_FILE = "recipeGraph.csr"
+#Last copy of gw2tp's bulk item names, kept so that unchanged lists don't need downloading again
+CONST_BULK_FILE = "itemNames.json"
+#Index from item names to IDs, rebuilt whenever the stored item list changes
+CONST_NAME_INDEX_FILE = "nameIndex.pickle"
+#What is left of a sale after the trading post's 5% listing fee and 10% exchange fee
+CONST_TP_KEEP = 0.85
+#How long a trading post price stays fresh (seconds), and how many prices to hold on to between searches
+CONST_PRICE_TTL = 300
+CONST_PRICE_CACHE_SIZE = 20000
+#Where every fetched price is kept (one folder per day), and how many days --smooth takes the median over by default
+CONST_HISTORY_DIR = "priceHistory"
+CONST_HISTORY_DAYS = 7
+#Batch sizes (number of crafts) that --depth works out the profit of, and how many of the best recipes it does so for
+CONST_BATCH_SIZES = (1, 2, 5, 10, 25, 50, 100, 250)
+CONST_CURVE_RECIPES = 10
+#Cost evaluations smaller than this stay on one core, since starting the processes would take longer than the evaluation
+CONST_PARALLEL_COST_MIN = 10000
+#Layers of the cost evaluation smaller than this are done by the main process rather than sent out to the workers
+CONST_PARALLEL_LAYER_MIN = 200
+#Streamed responses and files are read in chunks of this many bytes, and streamed records are written to the store this many at a time
+CONST_STREAM_CHUNK = 65536
+CONST_STREAM_BATCH = 500
+#Backoff after a 429 starts here, doubles on every further 429 in a row, and never goes above the max
+CONST_BACKOFF_START = 0.25
+CONST_BACKOFF_MAX = 8
+#Where --record / --replay / --fallback keep their recorded API answers, and the status a replay gives for something never recorded
+CONST_CASSETTE_FILE = "cassette.sqlite3"
+CONST_NOT_RECORDED = 599
+#Upper bounds (seconds) of the API latency histogram buckets. Anything slower goes in one last bucket
+CONST_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+
+#Records for what the APIs tell us, instead of nested lists. They are slotted, so the thousands a sync or a search holds at once stay small
+#IDs are always ints. The stores below turn any ID they are handed into an int, so '19699' and 19699 can never end up as two entries
+#   Item        = name, tradeable (can be sold on the TP? None until the item has been looked up), vendorValue and skin (default skin ID)
+#                 vendorValue and skin are False when the item has none, and None until looked up
+#   Ingredient  = id, count, type ('Item', 'Currency', ...)
+#   Recipe      = ingredients, outputID, outputCount, disciplines, rating
+class Item:
+    __slots__ = ('name', 'tradeable', 'vendorValue', 'skin')
+
+    def __init__(self, name : str, tradeable : bool = None, vendorValue = None, skin = None):
+        self.name = name
+        self.tradeable = tradeable
+        self.vendorValue = vendorValue
+        self.skin = skin
+
+    #Builds the record from an /items reply
+    @classmethod
+    def fromAPI(cls, reply : dict) -> 'Item':
+        flags = reply['flags']
+        vendorValue = reply['vendor_value'] if 'vendor_value' in reply and 'NoSell' not in flags else False
+        tradeable = 'AccountBound' not in flags and 'SoulbindOnAcquire' not in flags
+        return cls(reply['name'], tradeable, vendorValue, reply.get('default_skin', False))
+
+    def __repr__(self):
+        return "Item({!r}, {!r}, {!r}, {!r})".format(self.name, self.tradeable, self.vendorValue, self.skin)
+
+
+
+class Ingredient:
+    __slots__ = ('id', 'count', 'type')
+
+    def __init__(self, id : int, count : int, type : str):
+        self.id = id
+        self.count = count
+        self.type = type
+
+    def __repr__(self):
+        return "Ingredient({!r}, {!r}, {!r})".format(self.id, self.count, self.type)
+
+
+
+class Recipe:
+    __slots__ = ('ingredients', 'outputID', 'outputCount', 'disciplines', 'rating')
+
+    def __init__(self, ingredients : list, outputID : int, outputCount : int, disciplines : list, rating : int):
+        self.ingredients = ingredients
+        self.outputID = outputID
+        self.outputCount = outputCount
+        self.disciplines = disciplines
+        self.rating = rating
+
+    #Builds the record from a /recipes reply
+    @classmethod
+    def fromAPI(cls, reply : dict) -> 'Recipe':
+        ingredients = [Ingredient(ingrd['id'], ingrd['count'], ingrd['type']) for ingrd in reply['ingredients']]
+        return cls(ingredients, reply['output_item_id'], reply['output_item_count'], reply['disciplines'], reply['min_rating'])
+
+    #The old list shape, [[list of ingredient IDs, quantity, type], [output ID, quantity], [discipline, rating]], as the old pickle cache has it
+    @classmethod
+    def fromLists(cls, lists : list) -> 'Recipe':
+        ingredients, (outputID, outputCount), (disciplines, rating) = lists
+        return cls([Ingredient(*ingrd) for ingrd in ingredients], outputID, outputCount, disciplines, rating)
+
+    def __repr__(self):
+        return "Recipe({!r}, {!r}, {!r}, {!r}, {!r})".format(self.ingredients, self.outputID, self.outputCount, self.disciplines, self.rating)
+
+
+
+#Counters and timers for working out where a slow query spent its time. One shared instance (metrics) is filled in by the transport, the lookups and the search phases
+#   api         = endpoint : {'calls', 'errors', 'throttled' (429s), 'seconds', 'histogram' : {latency bucket : calls}}
+#   waits       = 'rateLimit' (waiting on our own token bucket) / 'backoff' (sleeping after a 429) : seconds
+#   lookups     = 'itemToRecipe' / 'recipeList' / 'prices' : [hits, misses]
+#   phases      = phase name : seconds
+#   replayed    = [answers that came out of a cassette, when the oldest of them was recorded]
+#With tracing on, every phase and API call is also kept as an event for a Chrome trace file (chrome://tracing or Perfetto)
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracing = False
+        self.events = []
+        self.reset()
+
+    #Start counting from zero, i.e. at the start of each query. Trace events are kept until the trace is written
+    def reset(self):
+        with self.lock:
+            self.api = {}
+            self.waits = {'rateLimit' : 0.0, 'backoff' : 0.0}
+            self.lookups = {}
+            self.phases = {}
+            self.replayed = [0, None]
+
+    def call(self, endpoint : str, start : float, status : int):
+        seconds = monotonic() - start
+        with self.lock:
+            stats = self.api.get(endpoint)
+            if stats is None:
+                stats = self.api[endpoint] = {'calls' : 0, 'errors' : 0, 'throttled' : 0, 'seconds' : 0.0, 'histogram' : [0] * (len(CONST_LATENCY_BUCKETS) + 1)}
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            stats['histogram'][bisect_left(CONST_LATENCY_BUCKETS, seconds)] += 1
+            if status == 429:
+                stats['throttled'] += 1
+            elif status >= 400:
+                stats['errors'] += 1
+            if self.tracing:
+                self._event(endpoint, 'api', start, seconds, {'status' : status})
+
+    def replay(self, recordedAt : float):
+        with self.lock:
+            self.replayed[0] += 1
+            if self.replayed[1] is None or recordedAt < self.replayed[1]:
+                self.replayed[1] = recordedAt
+
+    #None if everything so far came from the API, otherwise how many answers were replayed and how old the oldest is
+    def staleness(self) -> dict:
+        with self.lock:
+            count, oldest = self.replayed
+        if not count:
+            return None
+        return {'replayed' : count, 'recordedAt' : datetime.fromtimestamp(oldest).isoformat(timespec = 'seconds'),
+                'ageHours' : round((datetime.now().timestamp() - oldest) / 3600, 1)}
+
+    def wait(self, reason : str, seconds : float):
+        with self.lock:
+            self.waits[reason] += seconds
+
+    def lookup(self, table : str, hits : int = 0, misses : int = 0):
+        with self.lock:
+            counts = self.lookups.setdefault(table, [0, 0])
+            counts[0] += hits
+            counts[1] += misses
+
+    #Times everything until end() (or the end of a with block) as the named phase
+    def phase(self, name : str) -> 'PhaseTimer':
+        return PhaseTimer(self, name)
+
+    def _event(self, name : str, category : str, start : float, seconds : float, args : dict = None):
+        self.events.append({'name' : name, 'cat' : category, 'ph' : 'X', 'ts' : round(start * 1e6), 'dur' : round(seconds * 1e6),
+                            'pid' : os.getpid(), 'tid' : threading.get_ident(), 'args' : args or {}})
+
+    def summary(self) -> dict:
+        with self.lock:
+            labels = ["<={}ms".format(round(bound * 1000)) for bound in CONST_LATENCY_BUCKETS] + [">{}ms".format(round(CONST_LATENCY_BUCKETS[-1] * 1000))]
+            return {
+                'api' : {endpoint : dict(stats, seconds = round(stats['seconds'], 4), histogram = dict(zip(labels, stats['histogram'])))
+                         for endpoint, stats in self.api.items()},
+                'waits' : {reason : round(seconds, 4) for reason, seconds in self.waits.items()},
+                'lookups' : {table : {'hits' : hits, 'misses' : misses} for table, (hits, misses) in self.lookups.items()},
+                'phases' : {name : round(seconds, 4) for name, seconds in self.phases.items()},
+                'replayed' : self.replayed[0],
+            }
+
+    def writeTrace(self, path : str):
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w") as file:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, file)
+
+
+
+class PhaseTimer:
+    def __init__(self, metrics : Metrics, name : str):
+        self.metrics = metrics
+        self.name = name
+        self.start = monotonic()
+
+    def end(self):
+        seconds = monotonic() - self.start
+        with self.metrics.lock:
+            self.metrics.phases[self.name] = self.metrics.phases.get(self.name, 0.0) + seconds
+            if self.metrics.tracing:
+                self.metrics._event(self.name, 'phase', self.start, seconds)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.end()
+
+
+metrics = Metrics()
+
+
+
+#Token bucket that mirrors how the GW2 API meters us, shared by every thread making calls
+#Tokens refill continuously at perSecond up to capacity. Taking a token when the bucket is empty waits exactly as long as the refill needs
+class TokenBucket:
+    def __init__(self, perSecond : float = CONST_RATE_PER_SECOND, capacity : int = CONST_RATE_BURST):
+        self.perSecond = perSecond
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now : float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.perSecond)
+        self.updated = now
+
+    #Block until a token is available and take it. Tokens can go negative, which queues later callers behind this one
+    def acquire(self):
+        with self.lock:
+            now = monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = -self.tokens / self.perSecond if self.tokens < 0 else 0
+        if wait > 0:
+            metrics.wait('rateLimit', wait)
+            sleep(wait)
+
+    #The server told us we are out (429), so our model was optimistic. Throw away what we think we have left
+    def drain(self):
+        with self.lock:
+            self._refill(monotonic())
+            self.tokens = min(self.tokens, 0)
+
+
+
+#Transport layer that every API call goes through
+#Holds one keep-alive session (sized for the search thread pool) and the token bucket, and retries 429s in a loop with backoff
+class APITransport:
+    def __init__(self, bucket : TokenBucket = None, poolSize : int = CONST_SEARCH_WORKERS):
+        self.bucket = bucket if bucket is not None else TokenBucket()
+        self.poolSize = poolSize
+        self.session = None
+        self.sessionLock = threading.Lock()
+
+    #How many answers this thread has had from somewhere other than the API. Only a cassette ever has any
+    def replays(self) -> int:
+        return 0
+
+    #The session (and requests itself) is only set up once the first call goes out
+    def _session(self):
+        with self.sessionLock:
+            if self.session is None:
+                import requests
+                self.session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections = 2, pool_maxsize = self.poolSize)
+                self.session.mount('https://', adapter)
+                self.session.mount('http://', adapter)
+            return self.session
+
+    #Returns the final requests.Response. Anything other than a 429 is handed back for the caller to deal with
+    #With stream set, the body is left unread so that it can be consumed in chunks (see APIStream)
+    #Every request is recorded in metrics under endpoint
+    def get(self, url : str, timeout : float = 2, headers : dict = None, stream : bool = False, endpoint : str = 'other') -> 'requests.Response':
+        backoff = CONST_BACKOFF_START
+        while True:
+            self.bucket.acquire()
+            start = monotonic()
+            response = self._session().get(url, timeout = timeout, headers = headers, stream = stream)
+            metrics.call(endpoint, start, response.status_code)
+            if response.status_code != 429:
+                return response
+            response.close()
+
+            #Respect the server's own hint if it gives one, otherwise back off exponentially
+            self.bucket.drain()
+            retryAfter = response.headers.get('Retry-After')
+            wait = float(retryAfter) if retryAfter and retryAfter.isdigit() else backoff
+            print("We have hit the limit on API requests. Waiting {:.2f} seconds before trying again...".format(wait))
+            metrics.wait('backoff', wait)
+            sleep(wait)
+            backoff = min(backoff * 2, CONST_BACKOFF_MAX)
+
+
+transport = APITransport()
+
+
+
+#Response read back out of a cassette. Has the parts of requests.Response the program uses
+class CassetteResponse:
+    def __init__(self, status_code : int, headers : dict, content : bytes, recordedAt : float = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.recordedAt = recordedAt
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunkSize : int):
+        for i in range(0, len(self.content), chunkSize):
+            yield self.content[i:i + chunkSize]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+
+#Transport that keeps every successful response in an on-disk cassette, so whole queries can be run again without the API
+#   record      calls the API as usual and saves each 200 / 206 answer
+#   replay      answers everything from the cassette. No network and no rate limit, so runs are deterministic and only the compute is timed
+#   fallback    calls the API and records, but answers from the cassette when the API can't be reached or is down
+#Answers are keyed by path and parameters with the ID list sorted, so the same set of IDs in any order is the same answer. API keys are hashed
+#Every replayed answer is reported to metrics with when it was recorded, which is how results get marked as stale
+#replays() counts them per thread, so a caller can tell whether the answers it just got were live (see commerceAPICall)
+class CassetteTransport(APITransport):
+    def __init__(self, mode : str, path : str = CONST_CASSETTE_FILE, bucket : TokenBucket = None):
+        super().__init__(bucket)
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB, recorded REAL)")
+
+    @staticmethod
+    def key(url : str) -> str:
+        parsed = urlparse(url)
+        params = parse_qs(parsed.query, keep_blank_values = True)
+        params.pop('v', None)
+        if 'ids' in params:
+            params['ids'] = [",".join(str(id) for id in sorted({int(id) for id in params['ids'][0].split(',') if id}))]
+        if 'access_token' in params:
+            params['access_token'] = [hashlib.sha256(params['access_token'][0].encode()).hexdigest()[:16]]
+        return parsed.path + "?" + "&".join("{}={}".format(name, values[0]) for name, values in sorted(params.items()))
+
+    def _load(self, key : str) -> CassetteResponse:
+        with self.lock:
+            rows = self.connection.execute("SELECT status, headers, body, recorded FROM responses WHERE key = ?", (key,)).fetchall()
+        if not rows:
+            return None
+        status, headers, body, recorded = rows[0]
+        return CassetteResponse(status, json.loads(headers), zlib.decompress(body), recorded)
+
+    def _save(self, key : str, response):
+        #Reading the body here means a recorded stream is held in memory once, which is the price of recording it
+        headers = {name : response.headers[name] for name in ('ETag', 'Last-Modified') if name in response.headers}
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses (key, status, headers, body, recorded) VALUES (?, ?, ?, ?, ?)",
+                                    (key, response.status_code, json.dumps(headers), zlib.compress(response.content), datetime.now().timestamp()))
+            self.connection.commit()
+
+    def replays(self) -> int:
+        return getattr(self.local, 'replays', 0)
+
+    def _replay(self, key : str, endpoint : str) -> CassetteResponse:
+        self.local.replays = self.replays() + 1
+        start = monotonic()
+        response = self._load(key)
+        if response is None:
+            response = CassetteResponse(CONST_NOT_RECORDED, {}, b'')
+        else:
+            metrics.replay(response.recordedAt)
+        metrics.call(endpoint, start, response.status_code)
+        return response
+
+    def get(self, url : str, timeout : float = 2, headers : dict = None, stream : bool = False, endpoint : str = 'other'):
+        key = self.key(url)
+        if self.mode == 'replay':
+            return self._replay(key, endpoint)
+
+        try:
+            response = super().get(url, timeout, headers, stream, endpoint)
+        except OSError:
+            if self.mode != 'fallback':
+                raise
+            print("Could not reach the API, answering from the cassette instead.")
+            return self._replay(key, endpoint)
+
+        if response.status_code in (200, 206):
+            self._save(key, response)
+        elif self.mode == 'fallback' and response.status_code >= 500:
+            response.close()
+            return self._replay(key, endpoint)
+        return response
+
+
+
+#Raised when an API call fails and the caller didn't ask to ignore errors. APIError has already printed what went wrong
+#It is a SystemExit, so the command line modes still stop with status 1 as before, while the server catches it and answers with an error
+class APIUnavailable(SystemExit):
+    def __init__(self, status : int):
+        super().__init__(1)
+        self.status = status
+
+
 
 #Function for API calling so that it doesn't clog up the code
-#Make the API call to the specified place. Check if we hit the limit. If we did, wait 2 seconds to regain 10 API calls and continue
+#Make the API call to the specified place through the shared transport, which handles the rate limit and any 429 retries
 #The version parameter is specifically for the recipes to return the types of ingredients correctly
+#link defaults to CONST_DEFAULT_LINK, read at call time so the whole program can be pointed at another server (i.e. the benchmark's fake API)
 #Return the .json()
-def APICall(extension : str, ID : str, ignore = False, link : str = CONST_DEFAULT_LINK):
-    response = requests.get(link + extension + ID + "&v=2022-03-09T02:00:00.000Z", timeout = 2)
-    error = None
+def APICall(extension : str, ID : str, ignore = False, link : str = None):
+    response = transport.get((link or CONST_DEFAULT_LINK) + extension + ID + "&v=2022-03-09T02:00:00.000Z", endpoint = endpointName(extension))
+    error = APIError(response, ID)
+    if error is None:
+        return response.json()
+    if not ignore:
+        raise APIUnavailable(error)
+    else:
+        return error
+
+
+
+#Same as APICall, but for endpoints that answer with a list. The records are parsed one at a time as the body comes in and yielded,
+#so a large batch never sits in memory as one big list. key picks the list out of an object, i.e. gw2tp's {"items": [...]}
+#If ignore is set, an error just yields nothing. Statuses in empty mean 'no records' for this endpoint, and yield nothing without a word
+def APIStream(extension : str, ID : str, ignore = False, link : str = None, key : str = None, empty : tuple = ()):
+    response = transport.get((link or CONST_DEFAULT_LINK) + extension + ID + "&v=2022-03-09T02:00:00.000Z", stream = True, endpoint = endpointName(extension))
+    with response:
+        if response.status_code in empty:
+            return
+        error = APIError(response, ID)
+        if error is None:
+            yield from iterJSONArray(response.iter_content(CONST_STREAM_CHUNK), key)
+        elif not ignore:
+            raise APIUnavailable(error)
+
+
+
+#The endpoint an extension belongs to, for the metrics. i.e. 'recipes/search?input=' -> 'recipes/search'
+def endpointName(extension : str) -> str:
+    path = extension.split('?')[0].rstrip('/')
+    #Character names are part of the path, so every character's inventory counts as the same endpoint
+    if path.startswith('characters/'):
+        return 'characters/' + path.rsplit('/', 1)[1]
+    return path
+
+
+
+#Prints what went wrong with an API call. Returns the error code, or None if the response is fine to use
+def APIError(response : 'requests.Response', ID : str):
     match response.status_code:
-        case 429:
-            print("We have hit the limit on API requests. Temporarily sleeping to regain uses of the API...")
-            sleep(1)
-            print("...zzz...")
-            sleep(1)
-            print("10 uses regained, continuing...\n")
-            return APICall(extension, ID, ignore, link)
         case 403:
             print("The given API key appears to be invalid, or does not have the necessary permissions")
             print(ID)
@@ -36,13 +516,73 @@ def APICall(extension : str, ID : str, ignore = False, link : str = CONST_DEFAUL
         case 503:
             print("Given endpoint is disabled. Program will not work until it is updated. Bug the developer.")
             error = 503
+        case 599:
+            print("This was never recorded, so it can't be replayed. Run the same search with --record (or --fallback) first")
+            error = 599
         case _:
-            return response.json()
-        
-    if not ignore:
-        exit(1)
-    else:
-        return error
+            error = None
+    return error
+
+
+
+#Incremental parser for a JSON list coming in as byte chunks (a streamed response body or a file read piece by piece)
+#Yields the elements one at a time, holding on to nothing but the unparsed part of the current chunk
+#key picks the list out of a top-level object, otherwise the payload itself has to be the list
+def iterJSONArray(chunks, key : str = None):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+
+    #Pulls in the next chunk, dropping what has already been parsed. False once the input runs out
+    def read() -> bool:
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[pos:] + utf8.decode(chunk)
+        pos = 0
+        return True
+
+    #Find the opening bracket, after the key if there is one
+    marker = '"{}"'.format(key) if key else None
+    while True:
+        found = buffer.find(marker or '[', pos)
+        if found >= 0:
+            pos = found + len(marker or '[')
+            if marker is None:
+                break
+            marker = None
+            continue
+        pos = max(pos, len(buffer) - len(marker or '['))
+        if not read():
+            raise ValueError("No JSON list found" + (" under '{}'".format(key) if key else ""))
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buffer):
+            if not read():
+                raise ValueError("JSON list ended early")
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            #The element is cut off at the end of the chunk
+            if not read():
+                raise
+            continue
+        #Only trust the element once the comma or bracket after it is in, since a number can run on into the next chunk
+        after = end
+        while after < len(buffer) and buffer[after] in ' \t\r\n':
+            after += 1
+        if (after == len(buffer) or buffer[after] not in ',]') and read():
+            continue
+        pos = end
+        yield value
 
 
 
@@ -53,7 +593,7 @@ def truncate(IDList : list):
     if len(IDList) > 200:
         for i in range(200):
             strID += str(IDList[i]) + ","
-        IDList = IDList[200:]
+        del IDList[:200]
     else:
         for i in IDList:
             strID += str(i) + ","
@@ -62,6 +602,28 @@ def truncate(IDList : list):
 
 
 
+#Function to run the single-ID recipes/search endpoint for many IDs at once
+#extension is either 'recipes/search?input=' or 'recipes/search?output=', IDList is any iterable of item IDs
+#Returns a dictionary of item ID : list of recipe IDs. Calls are spread over a thread pool but share the transport's token bucket, so the limits still hold
+def searchAPICall(extension : str, IDList, workers : int = CONST_SEARCH_WORKERS) -> dict:
+    IDList = list(dict.fromkeys(IDList))
+    if not IDList:
+        return {}
+    with ThreadPoolExecutor(max_workers = min(workers, len(IDList))) as pool:
+        responses = pool.map(lambda id: APICall(extension, str(id)), IDList)
+        return dict(zip(IDList, responses))
+
+
+
+#Wrapper around searchAPICall that knows about a fully synced recipe graph (see syncRecipeGraph)
+#If the graph is complete, an item that is not in itemToRecipe simply has no recipes, so there is nothing to ask the API
+def recipeSearch(extension : str, IDList, settings : 'SettingsTable') -> dict:
+    if settings.get('graph'):
+        return {id : [] for id in IDList}
+    return searchAPICall(extension, IDList)
+
+
+
 #Function to get a list of ids and gather + sort all the info
 #Takes in the list of IDs and returns a dictionary that can be merged with recipeList AND a list of IDs that each recipe outputs
 def recipeAPICall(IDList : list):
@@ -71,25 +633,9 @@ def recipeAPICall(IDList : list):
         strID = truncate(IDList)
         
         #Get all the recipe data from our current limit
-        response = APICall('recipes?ids=', strID)
-        for reply in response:
-            # recipeList = Recipe ID : [[list of ingredient IDs, quantity, type], [output ID, quantity], [discipline, rating]]
-            #Gather all the ingredients into an array
-            ingredients = []
-            for ingrd in reply['ingredients']:
-                thisIngrd = [ingrd['id'], ingrd['count'], ingrd['type']]
-                ingredients.append(thisIngrd)
-            recipeList[reply] = [
-                ingredients,
-                [
-                    reply['output_item_id'],
-                    reply['output_item_count']
-                ],
-                [
-                    reply['disciplines'],
-                    reply['min_rating']
-                ]
-            ]
+        for reply in APIStream('recipes?ids=', strID):
+            # recipeList = Recipe ID : Recipe
+            recipeList[reply['id']] = Recipe.fromAPI(reply)
             returnIDs.append(reply['output_item_id'])
     
     return recipeList, returnIDs
@@ -99,10 +645,10 @@ def recipeAPICall(IDList : list):
 #Function to calculate the cost of buying a material
 #ID is a comma-separated STRING of item IDs
 #This returns sellValues, a DICTIONARY that matches an item ID to a list of the BUY value [0] and SELL value [1]
+#The trading post answers 404 when none of the IDs have listings, which only means there are no prices to give
 def sellInfo(ID : str):
     sellValues = {}
-    TPInfo = APICall('commerce/prices?ids=', ID)
-    for item in TPInfo:
+    for item in APIStream('commerce/prices?ids=', ID, empty = (404,)):
         baseBuy = item['buys']['unit_price']
         baseSell = item['sells']['unit_price']
         sellValues[item['id']] = [baseBuy, baseSell]
@@ -110,117 +656,558 @@ def sellInfo(ID : str):
 
 
 
-#Simple wrapper for truncation and sellInfo
+#Simple wrapper for truncation and sellInfo. Everything fetched also goes into the price history, unless it was replayed from a cassette
+#(--replay, or --fallback while the API is down), since old prices stamped with today's date would skew the medians
 def commerceAPICall(IDList : list):
     priceInfo = {}
     while IDList:
         strID = truncate(IDList)
-        priceInfo.update(sellInfo(strID))
+        replays = transport.replays()
+        batch = sellInfo(strID)
+        if transport.replays() == replays:
+            priceHistory.record(batch)
+        priceInfo.update(batch)
     return priceInfo
 
 
 
+#Calls commerce/listings, 200 IDs at a time. Returns books = ID : OrderBook for every ID with listings
+def listingsAPICall(IDList : list) -> dict:
+    books = {}
+    while IDList:
+        strID = truncate(IDList)
+        for reply in APIStream('commerce/listings?ids=', strID, empty = (404,)):
+            books[reply['id']] = OrderBook.fromAPI(reply)
+    return books
+
+
+
+#An item's trading post order book, kept as cumulative arrays so that any quantity is one binary search away
+#   buyQuantity[i], buyCoin[i]      units on offer and their total price over the best i + 1 buy orders (highest price first), what instant selling fills
+#   sellQuantity[i], sellCoin[i]    the same over the sell listings (lowest price first), what instant buying fills
+#   buyPrice[i], sellPrice[i]       unit price at each level
+class OrderBook:
+    __slots__ = ('buyQuantity', 'buyCoin', 'buyPrice', 'sellQuantity', 'sellCoin', 'sellPrice')
+
+    def __init__(self, buys : list, sells : list):
+        self.buyQuantity, self.buyCoin, self.buyPrice = self._cumulative(sorted(buys, key = lambda level: -level[0]))
+        self.sellQuantity, self.sellCoin, self.sellPrice = self._cumulative(sorted(sells))
+
+    #Builds the book from a commerce/listings reply
+    @classmethod
+    def fromAPI(cls, reply : dict) -> 'OrderBook':
+        return cls([(level['unit_price'], level['quantity']) for level in reply['buys']],
+                   [(level['unit_price'], level['quantity']) for level in reply['sells']])
+
+    #levels = [(unit price, quantity), ...] best first
+    @staticmethod
+    def _cumulative(levels : list) -> tuple:
+        quantity, coin, price = array('q'), array('q'), array('q')
+        units = total = 0
+        for unitPrice, count in levels:
+            units += count
+            total += unitPrice * count
+            quantity.append(units)
+            coin.append(total)
+            price.append(unitPrice)
+        return quantity, coin, price
+
+    #Coin to fill n units off the given side, or None if it does not go that deep
+    @staticmethod
+    def _fill(quantity : array, coin : array, price : array, n : int):
+        if n <= 0:
+            return 0
+        if not quantity or n > quantity[-1]:
+            return None
+        level = bisect_left(quantity, n)
+        if level == 0:
+            return n * price[0]
+        return coin[level - 1] + (n - quantity[level - 1]) * price[level]
+
+    def bestBuy(self) -> int:
+        return self.buyPrice[0] if self.buyPrice else 0
+
+    def bestSell(self) -> int:
+        return self.sellPrice[0] if self.sellPrice else 0
+
+    #Cost to get n units. Instant buying works up the sell listings. Otherwise it is a buy order just above the best one, which does not move with n
+    def costToBuy(self, n : int, instantTP : bool = True) -> float:
+        if not instantTP:
+            return n * (self.bestBuy() + 1)
+        cost = self._fill(self.sellQuantity, self.sellCoin, self.sellPrice, n)
+        return math.inf if cost is None else cost
+
+    #Revenue from n units, before the trading post's cut. Instant selling works down the buy orders, None if there aren't enough of them
+    #Otherwise it is a listing at the lowest sell price, which does not move with n
+    def revenueFromSelling(self, n : int, instantTP : bool = True):
+        if not instantTP:
+            return n * self.bestSell()
+        return self._fill(self.buyQuantity, self.buyCoin, self.buyPrice, n)
+
+
+
+#Cache for commerce/prices so that back-to-back searches reuse prices they fetched moments ago
+#   prices      = ID : (time fetched, [buyCost, sellCost] or None if the item has no listings), least recently used first
+#fetch swaps what gets cached, i.e. listingsAPICall keeps OrderBooks instead of prices. name is what the metrics call its hit rate
+#Each entry is fresh for ttl seconds, unless the item has its own window in itemTTL. Only stale or missing IDs get fetched, 200 at a time
+#Once there are more than maxSize entries the least recently used ones are dropped
+class PriceCache:
+    def __init__(self, ttl : float = CONST_PRICE_TTL, maxSize : int = CONST_PRICE_CACHE_SIZE, fetch = None, name : str = 'prices'):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.fetch = fetch or commerceAPICall
+        self.name = name
+        self.itemTTL = {}
+        self.prices = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    #Give an item its own freshness window, i.e. something that barely trades can be kept for longer
+    def setTTL(self, itemID : int, ttl : float):
+        self.itemTTL[itemID] = ttl
+
+    def _fresh(self, itemID : int, now : float) -> bool:
+        entry = self.prices.get(itemID)
+        return entry is not None and now - entry[0] < self.itemTTL.get(itemID, self.ttl)
+
+    #Returns itemPriceInfo = ID : [buyCost, sellCost] for every ID that has listings, fetching only what is stale
+    def get(self, IDList) -> dict:
+        IDList = list(dict.fromkeys(IDList))
+        now = monotonic()
+        with self.lock:
+            stale = [id for id in IDList if not self._fresh(id, now)]
+            self.hits += len(IDList) - len(stale)
+            self.misses += len(stale)
+        metrics.lookup(self.name, len(IDList) - len(stale), len(stale))
+
+        fetched = self.fetch(list(stale))
+
+        priceInfo = {}
+        with self.lock:
+            for id in stale:
+                self.prices[id] = (now, fetched.get(id))
+            for id in IDList:
+                entry = self.prices.get(id)
+                if entry is None:
+                    continue
+                self.prices.move_to_end(id)
+                if entry[1] is not None:
+                    priceInfo[id] = entry[1]
+            while len(self.prices) > self.maxSize:
+                self.prices.popitem(last = False)
+        return priceInfo
+
+    def stats(self) -> dict:
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : len(self.prices)}
+
+
+
+#Append-only history of every trading post price fetched, so margins can be followed over time and ranked on smoothed prices
+#Kept as one folder per UTC day (YYYY-MM-DD) under path, holding one file per column:
+#   time.u32, item.u32, buy.u32, sell.u32   fixed-width unsigned 32 bit columns, row i of each file being one fetched price
+#Recording only appends to today's files, so nothing is ever rewritten. Queries memory-map the days they cover and filter them with NumPy
+#A crash in the middle of an append can leave the columns at different lengths, so readers only use the rows every column has
+class PriceHistory:
+    COLUMNS = ('time', 'item', 'buy', 'sell')
+
+    def __init__(self, path : str = CONST_HISTORY_DIR):
+        self.path = path
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def day(timestamp : float) -> str:
+        return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+    #Appends itemPriceInfo = ID : [buyCost, sellCost], all stamped with the same time (now by default)
+    def record(self, itemPriceInfo : dict, timestamp : float = None):
+        if not itemPriceInfo:
+            return
+        timestamp = datetime.now().timestamp() if timestamp is None else timestamp
+        IDs = list(itemPriceInfo)
+        columns = (array('I', [int(timestamp)] * len(IDs)), array('I', IDs),
+                   array('I', (itemPriceInfo[id][0] for id in IDs)), array('I', (itemPriceInfo[id][1] for id in IDs)))
+        folder = os.path.join(self.path, self.day(timestamp))
+        with self.lock:
+            os.makedirs(folder, exist_ok = True)
+            for name, column in zip(self.COLUMNS, columns):
+                with open(os.path.join(folder, name + '.u32'), 'ab') as file:
+                    column.tofile(file)
+
+    #The day folders that overlap [start, end), oldest first
+    def days(self, start : float, end : float) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        first, last = self.day(start), self.day(end)
+        return sorted(day for day in os.listdir(self.path) if first <= day <= last)
+
+    #One day's columns as read-only memory maps, cut to the rows they all have. None if the day is empty
+    def _segment(self, day : str) -> list:
+        import numpy as np
+        paths = [os.path.join(self.path, day, name + '.u32') for name in self.COLUMNS]
+        rows = min(os.path.getsize(path) // 4 if os.path.exists(path) else 0 for path in paths)
+        if rows == 0:
+            return None
+        return [np.memmap(path, dtype = np.uint32, mode = 'r', shape = (rows,)) for path in paths]
+
+    #Every price recorded for the given IDs in [start, end), as the arrays (time, item, buy, sell)
+    def window(self, IDList, start : float, end : float) -> list:
+        import numpy as np
+        IDs = np.fromiter(IDList, dtype = np.uint32)
+        parts = []
+        for day in self.days(start, end):
+            segment = self._segment(day)
+            if segment is None:
+                continue
+            times, items = segment[0], segment[1]
+            rows = np.flatnonzero((times >= start) & (times < end) & np.isin(items, IDs))
+            parts.append([np.asarray(column[rows]) for column in segment])
+        if not parts:
+            return [np.zeros(0, dtype = np.uint32) for _ in self.COLUMNS]
+        return [np.concatenate(columns) for columns in zip(*parts)]
+
+    #Returns ID : [median buy, median sell] over the last `days` days, for every ID in IDList that has any history
+    #Each column is sorted once by (item, price), so every item's median sits at a fixed offset into its run
+    #Prices are whole coins everywhere else, so an even count's midpoint is rounded half up to one
+    def medians(self, IDList, days : float = CONST_HISTORY_DAYS, now : float = None) -> dict:
+        import numpy as np
+        now = datetime.now().timestamp() if now is None else now
+        _, items, buys, sells = self.window(IDList, now - days * 86400, now + 1)
+        if len(items) == 0:
+            return {}
+        columns = []
+        for values in (buys, sells):
+            order = np.lexsort((values, items))
+            uniqueItems, starts, counts = np.unique(items[order], return_index = True, return_counts = True)
+            values = values[order].astype(np.int64)
+            columns.append((values[starts + (counts - 1) // 2] + values[starts + counts // 2] + 1) // 2)
+        return {id : [buy, sell] for id, buy, sell in zip(uniqueItems.tolist(), columns[0].tolist(), columns[1].tolist())}
+
+    #itemPriceInfo with every price swapped for its median over the last `days` days. Items with no history keep the price they came with
+    def smooth(self, itemPriceInfo : dict, days : float = CONST_HISTORY_DAYS) -> dict:
+        medians = self.medians(itemPriceInfo, days)
+        return {id : medians.get(id, prices) for id, prices in itemPriceInfo.items()}
+
+#Every price fetch is recorded here (see commerceAPICall)
+priceHistory = PriceHistory()
+
+
+
 #Calls the items API resource. Takes in a list of IDs and itemList, and returns commerceIDList with itemList being modified
 #Will gather all item info if it is not present in itemList
 def itemAPICall(IDList : list, itemList : dict):
     commerceIDs = []
-    strID = truncate(IDList)
-    response = APICall("items?ids=", strID)
-    for reply in response:
-        #Gather all the info and put it into the itemList
-        if reply['id'] not in itemList:
-            print("Found and item that was not in the list? ID : {}, and name : {}".format(reply['id'], reply['name']))
-            itemList['id'] = [reply['name'], None, None, None]
-        
-        vendorValue, TPSell, skinID = None
-        if 'vendor_value' in reply and 'NoSell' not in reply['flags']:
-            vendorValue = reply['vendor_value']
-        else:
-            vendorValue = False
-        
-        if 'AccountBound' not in reply['flags'] and 'SoulbindOnAcquire' not in reply['flags']:
-            TPSell = True
-            commerceIDs.append(reply['id'])
-        else:
-            TPSell = False
-        
-        if 'default_skin' in reply:
-            skinID = reply['default_skin']
-        else:
-            skinID = False
-        
-        itemList['id'] = [itemList['id'][0], vendorValue, TPSell, skinID]
+    while IDList:
+        strID = truncate(IDList)
+        for reply in APIStream("items?ids=", strID):
+            #Gather all the info and put it into the itemList
+            if reply['id'] not in itemList:
+                print("Found and item that was not in the list? ID : {}, and name : {}".format(reply['id'], reply['name']))
+
+            # itemList = ID : Item
+            item = Item.fromAPI(reply)
+            if item.tradeable:
+                commerceIDs.append(reply['id'])
+            itemList[reply['id']] = item
     return commerceIDs
 
 
 
-#Takes the base itemID, the recipeID to check the cost for, and then various dictionaries to reference
-#Returns the cost of the recipe to craft and a list of recipes used to achieve that cost
-def recursiveCost(itemID : int, recipeID : int, instantTP : bool, itemPriceInfo : dict, recipeList : dict, itemToRecipe : dict, itemList : dict, potentialRecipes : dict):
-    #Check to see if we already covered this recipe in another call. If we have the crafting cost, just return that.
-    if recipeID in potentialRecipes and potentialRecipes[recipeID][0] != False:
-        return potentialRecipes[recipeID][0], potentialRecipes[recipeID][1]
+#Cost engine. Works out the cheapest buy-or-craft cost for everything below a set of recipes in a single bottom-up pass
+#   recipeCost  = Recipe ID : cost to craft it once, with every ingredient bought or crafted, whichever is cheaper
+#   choices     = Recipe ID : {ingredient ID : recipe ID used to craft it, or None to buy it}
+#   itemCost    = Item ID : cheapest cost of a single unit, bought or crafted
+#   itemRecipe  = Item ID : recipe that gives that cheapest unit cost, or None if buying is cheaper
+#The searched-for item itself costs nothing (we are trying to use it up), and currencies are free as far as coin goes
+#Refinement and mystic forge recipes can loop back on themselves. The loop is broken at the edge that closes it, so that maker is ignored there
+#With workers above 1, big evaluations are spread over that many processes (see _evaluateLayers). The results are the same either way
+class CostTable:
+    def __init__(self, itemID : int, rootRecipes, instantTP : bool, itemPriceInfo : dict, recipeList, itemToRecipe, workers : int = 1):
+        self.itemID = itemID
+        self.instantTP = instantTP
+        self.itemPriceInfo = itemPriceInfo
+        self.recipeList = recipeList
+        self.itemToRecipe = itemToRecipe
+        self.roots = set(rootRecipes)
+        self.recipeCost = {}
+        self.choices = {}
+        self.itemCost = {}
+        self.itemRecipe = {}
+        self.brokenEdges = set()
+        self._candidates = {}
+        self._recipes = {}
+
+        ordered = self.order()
+        if workers > 1 and len(ordered) >= CONST_PARALLEL_COST_MIN:
+            self._evaluateLayers(ordered, workers)
+        else:
+            for recipeID in ordered:
+                self._evaluate(recipeID)
+        for recipeID in ordered:
+            self._track(recipeID)
+
+    #A table that evaluates whatever recipes it is handed, for the worker processes of _evaluateLayers
+    #It gets the recipes and candidate makers the parent already looked up, instead of the stores, and the costs it needs along with each batch
+    @classmethod
+    def shared(cls, itemID : int, instantTP : bool, itemPriceInfo : dict, recipes : dict, candidates : dict, brokenEdges : set) -> 'CostTable':
+        table = cls.__new__(cls)
+        table.itemID = itemID
+        table.instantTP = instantTP
+        table.itemPriceInfo = itemPriceInfo
+        table.recipeList = table.itemToRecipe = None
+        table.roots = set()
+        table.recipeCost = {}
+        table.choices = {}
+        table.itemCost = {}
+        table.itemRecipe = {}
+        table.brokenEdges = brokenEdges
+        table._candidates = candidates
+        table._recipes = recipes
+        return table
+
+    #Cost of buying a single unit off the trading post, based on the user's preference. Infinity if it can't be bought
+    def buyCost(self, itemID : int) -> float:
+        if itemID not in self.itemPriceInfo:
+            return math.inf
+        if self.instantTP:
+            return self.itemPriceInfo[itemID][1]
+        return self.itemPriceInfo[itemID][0] + 1
+
+    def _recipe(self, recipeID : int):
+        if recipeID not in self._recipes:
+            self._recipes[recipeID] = self.recipeList[recipeID] if recipeID in self.recipeList else None
+        return self._recipes[recipeID]
+
+    #Recipes that can make the item. If some of them are recipes we started from, only those are used (covers cases like Prismatium Ingot)
+    #Items we never searched downwards (the outputs of the recipes we started from) fall back to the recipe store's output index
+    def candidates(self, itemID : int) -> list:
+        if itemID not in self._candidates:
+            if itemID in self.itemToRecipe and self.itemToRecipe[itemID][1] is not None:
+                makers = self.itemToRecipe[itemID][1]
+            else:
+                makers = self.recipeList.making(itemID)
+            makers = (makers & self.roots) or makers
+            self._candidates[itemID] = sorted(id for id in makers if self._recipe(id) is not None)
+        return self._candidates[itemID]
+
+    #Items in the recipe that cost coin, as (ingredient ID, count)
+    def _costedIngredients(self, recipeID : int):
+        for ingredient in self._recipe(recipeID).ingredients:
+            if ingredient.type == 'Item' and ingredient.id != self.itemID:
+                yield ingredient.id, ingredient.count
+
+    #Depth-first post-order over the recipes reachable from the roots, so every recipe comes after the recipes it depends on
+    #Done with an explicit stack, so deep trees can't hit the recursion limit. An edge back to a recipe still on the stack is a cycle and gets dropped
+    def order(self) -> list:
+        ordered = []
+        state = {}
+        for root in sorted(self.roots):
+            if root in state or self._recipe(root) is None:
+                continue
+            state[root] = 'open'
+            stack = [(root, iter(list(self._dependencies(root))))]
+            while stack:
+                recipeID, children = stack[-1]
+                for child in children:
+                    if child not in state:
+                        state[child] = 'open'
+                        stack.append((child, iter(list(self._dependencies(child)))))
+                        break
+                    if state[child] == 'open':
+                        self.brokenEdges.add((recipeID, child))
+                else:
+                    stack.pop()
+                    state[recipeID] = 'done'
+                    ordered.append(recipeID)
+        return ordered
+
+    def _dependencies(self, recipeID : int):
+        for ingredientID, _ in self._costedIngredients(recipeID):
+            yield from self.candidates(ingredientID)
+
+    def _evaluate(self, recipeID : int):
+        total = 0
+        choices = {}
+        for ingredientID, count in self._costedIngredients(recipeID):
+            best = count * self.buyCost(ingredientID)
+            bestRecipe = None
+            for craftRecipe in self.candidates(ingredientID):
+                if (recipeID, craftRecipe) in self.brokenEdges or craftRecipe not in self.recipeCost:
+                    continue
+                #If the recipe makes less than we need, craft it as many times as it takes
+                craftOutput = self._recipe(craftRecipe).outputCount
+                cost = math.ceil(count / craftOutput) * self.recipeCost[craftRecipe]
+                if cost < best:
+                    best = cost
+                    bestRecipe = craftRecipe
+            total += best
+            choices[ingredientID] = bestRecipe
+        self.recipeCost[recipeID] = total
+        self.choices[recipeID] = choices
+
+    #Puts an evaluated recipe into the per-item table. Done in the order of order(), so a tie between two makers goes to the same one every time
+    def _track(self, recipeID : int):
+        recipe = self._recipe(recipeID)
+        outputID = recipe.outputID
+        unitCost = self.recipeCost[recipeID] / recipe.outputCount
+        if outputID not in self.itemCost:
+            self.itemCost[outputID] = self.buyCost(outputID)
+            self.itemRecipe[outputID] = None
+        if unitCost < self.itemCost[outputID]:
+            self.itemCost[outputID] = unitCost
+            self.itemRecipe[outputID] = recipeID
+
+    #The same evaluation as the serial loop, spread over processes. A recipe's layer is one above the highest layer of the recipes it depends on,
+    #so a layer only needs the layers below it and can be split between the workers. Each batch carries the costs of exactly what it depends on
+    #The thin layers at the top of a tree aren't worth a round trip, so the main process does those itself
+    #The order, and the cycle edges it broke, still come from order(), so every recipe sees the same makers it would have seen serially
+    def _evaluateLayers(self, ordered : list, workers : int):
+        layers = []
+        dependsOn = {}
+        layerOf = {}
+        for recipeID in ordered:
+            dependsOn[recipeID] = {craftRecipe for craftRecipe in self._dependencies(recipeID) if (recipeID, craftRecipe) not in self.brokenEdges}
+            layer = 1 + max((layerOf[craftRecipe] for craftRecipe in dependsOn[recipeID]), default = -1)
+            layerOf[recipeID] = layer
+            if layer == len(layers):
+                layers.append([])
+            layers[layer].append(recipeID)
+
+        recipes = {recipeID : recipe for recipeID, recipe in self._recipes.items() if recipe is not None}
+        initargs = (self.itemID, self.instantTP, self.itemPriceInfo, recipes, self._candidates, self.brokenEdges)
+        with ProcessPoolExecutor(max_workers = workers, initializer = _initLayerWorker, initargs = initargs) as pool:
+            for layer in layers:
+                if len(layer) < CONST_PARALLEL_LAYER_MIN:
+                    for recipeID in layer:
+                        self._evaluate(recipeID)
+                    continue
+                size = math.ceil(len(layer) / workers)
+                tasks = []
+                for start in range(0, len(layer), size):
+                    batch = layer[start:start + size]
+                    known = {craftRecipe : self.recipeCost[craftRecipe] for recipeID in batch for craftRecipe in dependsOn[recipeID]}
+                    tasks.append((batch, known))
+                for evaluated in pool.map(_layerWorker, tasks):
+                    for recipeID, cost, choices in evaluated:
+                        self.recipeCost[recipeID] = cost
+                        self.choices[recipeID] = choices
+
+    #The recipe to use for an ingredient of the given recipe, or None if it should be bought
+    def choice(self, recipeID : int, ingredientID : int):
+        return self.choices.get(recipeID, {}).get(ingredientID)
+
+    #Only the results travel between processes. The prices and recipe data are shared, so the receiving side attaches its own copy
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('itemPriceInfo', 'recipeList', 'itemToRecipe', '_candidates', '_recipes'):
+            state[name] = None
+        return state
+
+    def attach(self, itemPriceInfo : dict, recipeList, itemToRecipe):
+        self.itemPriceInfo = itemPriceInfo
+        self.recipeList = recipeList
+        self.itemToRecipe = itemToRecipe
+        self._candidates = {}
+        self._recipes = {}
+
+
+
+#Scores and ranks a batch of recipes in one vectorized pass
+#Everything per recipe (output price, vendor value, sellability, craft cost) is laid out in aligned arrays, indexed by the recipe's position
+#Returns recipeProfit = [[ID, profitBuy, profitSell], ...] best first (profitBuy is False for vendor-only outputs), and the IDs that can't be sold at all
+#With topK, only the best topK are sorted and returned (argpartition), which is what makes scoring every recipe in the game cheap
+def rankRecipes(recipeIDs, recipeCosts : dict, recipeList, itemList, itemPriceInfo : dict, instantTP : bool, topK : int = None):
+    import numpy as np
+    recipeIDs = list(recipeIDs)
+    count = len(recipeIDs)
+    cost = np.fromiter((recipeCosts.get(id, math.inf) for id in recipeIDs), dtype = np.float64, count = count)
+    outputs = np.fromiter((recipeList[id].outputID for id in recipeIDs), dtype = np.int64, count = count)
+
+    #Item information only needs looking up once per distinct output, then gets spread back out to the recipes
+    uniqueOutputs, outputRow = np.unique(outputs, return_inverse = True)
+    buy = np.full(len(uniqueOutputs), np.nan)
+    sell = np.full(len(uniqueOutputs), np.nan)
+    vendor = np.zeros(len(uniqueOutputs))
+    tradeable = np.zeros(len(uniqueOutputs), dtype = bool)
+    for row, outputID in enumerate(uniqueOutputs.tolist()):
+        info = itemList[outputID] if outputID in itemList else Item(None)
+        if info.tradeable and outputID in itemPriceInfo:
+            tradeable[row] = True
+            buy[row], sell[row] = itemPriceInfo[outputID]
+        vendor[row] = info.vendorValue or 0
+
+    buy, sell, vendor, tradeable = buy[outputRow], sell[outputRow], vendor[outputRow], tradeable[outputRow]
+    profitBuy = buy * CONST_TP_KEEP - cost
+    profitSell = np.where(tradeable, sell * CONST_TP_KEEP - cost, vendor - cost)
+    sellable = np.isfinite(cost) & (tradeable | (vendor > 0))
+
+    #Vendor-only outputs have one way to sell, so they rank on that in either mode
+    key = np.where(tradeable, profitBuy if instantTP else profitSell, profitSell)
+    key = np.where(sellable, key, -np.inf)
+    order = np.flatnonzero(sellable)
+    if topK is not None and topK < len(order):
+        order = order[np.argpartition(-key[order], topK)[:topK]]
+    order = order[np.argsort(-key[order], kind = 'stable')]
+
+    recipeProfit = []
+    for row in order.tolist():
+        if tradeable[row]:
+            recipeProfit.append([recipeIDs[row], float(profitBuy[row]), float(profitSell[row])])
+        else:
+            recipeProfit.append([recipeIDs[row], False, float(profitSell[row])])
+    noSellIDs = [recipeIDs[row] for row in np.flatnonzero(~sellable).tolist()]
+    return recipeProfit, noSellIDs
+
+
+
+#Looks up everything we need to price the given items. Items we don't have details for go through /items first
+#Returns itemPriceInfo = ID : [buyCost, sellCost] for every item in IDList that is on the trading post
+#With a priceCache, prices that are still fresh are reused instead of fetched again
+#With smooth, every price is swapped for its median over that many days of price history (see PriceHistory), where there is any
+def gatherPrices(IDList, itemList, priceCache : PriceCache = None, smooth : float = None) -> dict:
+    APIcommerceIDs = []
+    APIitemIDs = []
+    for potentialID in dict.fromkeys(IDList):
+        #If we have the item info already, throw it into the 'commerce' bucket. Account bound items have no price to find
+        item = itemList[potentialID] if potentialID in itemList else None
+        if item is not None and item.tradeable != None:
+            if item.tradeable:
+                APIcommerceIDs.append(potentialID)
+        #Otherwise, we will throw it into the 'grab item info' pile
+        else:
+            APIitemIDs.append(potentialID)
+    APIcommerceIDs.extend(itemAPICall(APIitemIDs, itemList))
+    if priceCache is not None:
+        itemPriceInfo = priceCache.get(APIcommerceIDs)
+    else:
+        itemPriceInfo = commerceAPICall(APIcommerceIDs)
+    if smooth:
+        itemPriceInfo = priceHistory.smooth(itemPriceInfo, smooth)
+    return itemPriceInfo
 
-    craftRecipes = set()
-    craftCost = 0
-    #Otherwise, we go through each ingredient in the recipe
-    for ingredient in recipeList[recipeID][0]:
-        id = ingredient[0]
-        #"Cost" for the given item is not included. We have too much of it, we need to get rid of it
-        if id == itemID or ingredient[2] != "Item":
-            continue
 
-        #If there are no recipes to -make- the item, then it must be a base material that we need to buy from the trading post (or some other place)
-        #Add on t
-        if not itemToRecipe[id][1]:
-            thisCost = 0
-            if instantTP:
-                thisCost = (itemPriceInfo[id][1] * ingredient[1])
-            else:
-                thisCost = ((itemPriceInfo[id][0] + 1) * ingredient[1])
-            craftCost += thisCost
-            continue
 
-        #Otherwise, there's a recipe to go down
-        #Cost will be initialized based on user preference
-        ingredientCost = 0
-        if instantTP:
-            ingredientCost = itemPriceInfo[id][1] * ingredient[1]
-        else:
-            ingredientCost = (itemPriceInfo[id][0] + 1) * ingredient[1]
-        lowestID = False
-        lowestRecipes = []
-        
-        #Grab an intersection of all items that make this ingredient AND any potential recipes. Covers cases like Prismatium Ingot
-        ingRecipes = itemToRecipe[id][1]
-        recipeUnion = ingRecipes & set(potentialRecipes.keys())
-        #If there are similarities...
-        if len(recipeUnion) > 0:
-            ingRecipes = recipeUnion
-
-        for secondRecipe in ingRecipes:
-            compareCost, comparePrice, compareRecipes = recursiveCost(itemID, secondRecipe, instantTP, itemPriceInfo, recipeList, itemToRecipe, itemList, potentialRecipes)
-            #If recipe output is LESS than the required amount for the parent recipe, multiply it until it matches
-            if recipeList[secondRecipe][1][1] < ingredient[1]:
-                multVal = math.ceil(ingredient[1] / recipeList[secondRecipe][1][1])
-                compareCost *= multVal
-            #If cost is lowest, this recipe for this ingredient is the most efficient
-            #So we store the recipeID of that recipe, 
-            if compareCost < ingredientCost:
-                ingredientCost = compareCost
-                lowestID = secondRecipe
-                lowestRecipes = compareRecipes
-        
-        craftCost += ingredientCost
-        if lowestID:
-            craftRecipes.add(lowestID)
-            craftRecipes |= lowestRecipes
+#Scores every recipe in the synced graph against current prices and prints the best ones
+def scoreAllMain(topK : int, instantTP : bool, workers : int = None, smooth : float = None):
+    store = readFile()
+    graph = readGraph() if store.settings.get('graph') else None
+    if graph is None:
+        print("Scoring every recipe needs the full recipe graph. Run with --sync-graph first.")
+        return
+    recipeList, itemToRecipe = graph.recipeList, graph.itemToRecipe
 
-    if recipeID in potentialRecipes:
-        potentialRecipes[recipeID][0] = craftCost
-        potentialRecipes[recipeID][1] = craftRecipes
+    print("Pricing every item used or made by a recipe...")
+    itemPriceInfo = gatherPrices(list(graph.itemIDs), store.items, smooth = smooth)
+    store.commit()
+    print("Costing {} recipes...".format(len(recipeList)))
+    costs = CostTable(None, recipeList, instantTP, itemPriceInfo, recipeList, itemToRecipe, workers or os.cpu_count() or 1)
+    recipeProfit, _ = rankRecipes(recipeList, costs.recipeCost, recipeList, store.items, itemPriceInfo, instantTP, topK)
 
-    return craftCost, craftRecipes
+    for recipeID, profitBuy, profitSell in recipeProfit:
+        outputID = recipeList[recipeID].outputID
+        outputName = store.items[outputID].name if outputID in store.items else str(outputID)
+        shown = profitSell if profitBuy is False or not instantTP else profitBuy
+        print(printCost(round(shown)).rjust(20) + "\t" + outputName + " (recipe " + str(recipeID) + ")")
 
 
 
@@ -240,150 +1227,1902 @@ def printCost(value : int) -> str:
 
 
 
-def updateSkinAPI(itemList : dict) -> set:
+def updateSkinAPI(settings : 'SettingsTable') -> set:
     while True:
-        input = ("\nWould you like to prioritize crafting skins you do not have? To do this, we will need an API key with access to your 'Unlocks'.\n" + 
-                 "Paste your API key here. If you do not want this, leave the space empty and press enter : ")
-        if not input:
-            itemList['skins'] = False
+        key = input("\nWould you like to prioritize crafting skins you do not have? To do this, we will need an API key with access to your 'Unlocks'.\n" + 
+                    "Paste your API key here. If you do not want this, leave the space empty and press enter : ").strip()
+        if not key:
+            settings['skins'] = False
             return set()
 
-        skinResponse = APICall('account/skins?access_token=', input.strip(), ignore = True)
+        skinResponse = APICall('account/skins?access_token=', key, ignore = True)
         if type(skinResponse) is not int:
-            itemList['skins'] = True
-            itemList['API'] = input.strip()
+            settings['skins'] = True
+            settings['API'] = key
             return set(skinResponse)
         
 
 
-def updateItemList(itemList : dict, response : requests.Response = None) -> list:
-    if response is None:
-        response = APICall('items-names', '.json', link = 'https://api.gw2tp.com/1/bulk/')
-        response = response['items']
+#Grabs the unlocked skins with the stored API key. If the key stopped working, the interactive program asks for a new one
+#Without interactive, a bad key returns None so the caller can ask for a new one when it is able to
+def grabSkinInfo(settings : 'SettingsTable', interactive : bool = True) -> set:
+    skinResponse = APICall('account/skins?access_token=', settings['API'], ignore = True)
+    if type(skinResponse) is int:
+        print("It appears that the key provided was not valid or did not have the necessary permissions. Please ensure your key is updated.")
+        if interactive:
+            return updateSkinAPI(settings)
+        return None
+    return set(skinResponse)
 
-    addedItems = []
-    point = -1
-    index = response[point]
-    while index[0] not in itemList:
-        itemList[index[0]] = [index[1], None, None, None]
-        addedItems.append(index[0])
-        point -= 1
-        index = response[point]
-    return addedItems
 
 
+#Builds both directions of itemToRecipe from every recipe we know about, with no recipes/search calls at all
+#Every item that shows up in a recipe is written with both sets. Anything missing has no recipes, recipeSearch treats it that way once the graph is synced
+def linkRecipeGraph(recipeList : dict, itemToRecipe : dict):
+    links = {}
+    for recipeID, recipe in recipeList.items():
+        for ingrd in recipe.ingredients:
+            if ingrd.type == 'Item':
+                links.setdefault(ingrd.id, [set(), set()])[0].add(recipeID)
+        links.setdefault(recipe.outputID, [set(), set()])[1].add(recipeID)
+    itemToRecipe.update(links)
 
-def grabSkinInfo(itemList : dict) -> set:
-    skinResponse = APICall('account/skins?access_token=', itemList['API'], ignore = True)
-    if skinResponse == 403:
-        print("It appears that the key provided was not valid or did not have the necessary permissions. Please ensure your key is updated.")
-        return updateSkinAPI(itemList)
-    return set(skinResponse)
 
 
+#Pulls every recipe in the game through the batched recipes endpoint and links them locally
+#Only recipe IDs we do not already have are fetched, so running this again later only picks up newly added recipes
+#200-ID batches run on the same thread pool size as the searches and share the token bucket
+def syncRecipeGraph(settings : 'SettingsTable', recipeList : dict, itemToRecipe : dict, workers : int = CONST_SEARCH_WORKERS):
+    allIDs = APICall('recipes?', '')
+    known = set(recipeList)
+    missing = [id for id in allIDs if id not in known]
+    print("{} recipes in the game, {} not stored yet. Fetching in batches of 200...".format(len(allIDs), len(missing)))
 
-def readFile():
-    pass
+    batches = [missing[i:i + 200] for i in range(0, len(missing), 200)]
+    if batches:
+        with ThreadPoolExecutor(max_workers = min(workers, len(batches))) as pool:
+            for returnDict, _ in pool.map(recipeAPICall, batches):
+                recipeList.update(returnDict)
 
+    print("Linking {} recipes...".format(len(recipeList)))
+    #The stored links are rebuilt in SQL, so linking doesn't have to load every recipe
+    if isinstance(itemToRecipe, LinkTable):
+        itemToRecipe.relink()
+    else:
+        linkRecipeGraph(recipeList, itemToRecipe)
+    settings['recipe'] = True
+    settings['graph'] = True
+
+
+
+#Column helpers for the item table. The item entries use None for 'not looked up yet' and False for 'does not have one'
+def _boolColumn(value):
+    return None if value is None else int(bool(value))
+
+def _fromBoolColumn(value):
+    return None if value is None else bool(value)
+
+def _falseColumn(value):
+    return 0 if value is False else value
+
+def _fromFalseColumn(value):
+    return False if value == 0 else value
+
+
+
+#SQLite-backed storage for everything we accumulate between runs
+#Every table is indexed by the ID we look it up with, so nothing has to be read in at startup and every API result is upserted as it arrives
+#The dictionary-like views below (items, recipes, links, currencies) are keyed by int ID, settings by name:
+#   items       = ID : Item
+#   recipes     = Recipe ID : Recipe
+#   links       = Item ID : [{recipe IDs that use the item}, {recipe IDs that make the item}]   (None where we have not searched yet)
+#   currencies  = ID : name
+#   settings    = name : JSON value, for 'recipe', 'skins', 'API', 'graph' and the catalogue sync state
+class CacheStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, name TEXT, tp_sell INTEGER, vendor_value INTEGER, skin INTEGER);
+        CREATE TABLE IF NOT EXISTS recipes (id INTEGER PRIMARY KEY, output_id INTEGER, output_count INTEGER,
+                                            disciplines TEXT, min_rating INTEGER, ingredients TEXT);
+        CREATE INDEX IF NOT EXISTS recipes_by_output ON recipes (output_id);
+        CREATE TABLE IF NOT EXISTS searched (item_id INTEGER, direction INTEGER, PRIMARY KEY (item_id, direction));
+        CREATE TABLE IF NOT EXISTS links (item_id INTEGER, direction INTEGER, recipe_id INTEGER);
+        CREATE INDEX IF NOT EXISTS links_by_item ON links (item_id, direction);
+        CREATE TABLE IF NOT EXISTS currencies (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE IF NOT EXISTS pending (id INTEGER PRIMARY KEY);
+    """
+
+    def __init__(self, path : str = CONST_CACHE_DB):
+        self.path = path
+        #The connection is shared between threads (the search pool, and later callers), so every access goes through the lock
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.executescript(self.SCHEMA)
+        self.settings = SettingsTable(self)
+        self.items = ItemTable(self)
+        self.recipes = RecipeTable(self)
+        self.links = LinkTable(self)
+        self.currencies = CurrencyTable(self)
+
+    def execute(self, query : str, params = ()) -> list:
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def executemany(self, query : str, rows):
+        with self.lock:
+            self.connection.executemany(query, rows)
+
+    #Yields the rows of a query CONST_STREAM_BATCH at a time off one cursor, for passes over whole tables that shouldn't hold them all at once
+    def iterate(self, query : str, params = ()):
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(CONST_STREAM_BATCH)
+            if not rows:
+                return
+            yield from rows
+
+    def commit(self):
+        with self.lock:
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    #(ID, name) of every stored item, or only of the given IDs
+    def itemNames(self, IDList : list = None) -> list:
+        if IDList is None:
+            return self.execute("SELECT id, name FROM items")
+        rows = []
+        #SQLite allows up to 999 parameters per statement
+        for i in range(0, len(IDList), 900):
+            part = IDList[i:i + 900]
+            rows += self.execute("SELECT id, name FROM items WHERE id IN ({})".format(",".join("?" * len(part))), part)
+        return rows
 
+    #Every rename bumps the 'renames' setting, since a rename changes neither the count nor the highest ID in itemSignature
+    def renameItems(self, pairs : list):
+        if not pairs:
+            return
+        self.executemany("UPDATE items SET name = ? WHERE id = ?", [(name, id) for id, name in pairs])
+        self.settings['renames'] = (self.settings.get('renames') or 0) + 1
+
+    #(number of items, highest ID, renames so far), enough to tell whether the item list changed since something was built from it
+    def itemSignature(self) -> tuple:
+        return tuple(self.execute("SELECT COUNT(*), MAX(id) FROM items")[0]) + (self.settings.get('renames') or 0,)
 
-def writeFile(itemList : dict, recipeList : dict = None, itemToRecipe : dict = None):
-    pass
+    #Items the catalogue sync added that still need their details looked up
+    def pendingItems(self) -> list:
+        return [row[0] for row in self.execute("SELECT id FROM pending")]
 
+    def addPending(self, IDList):
+        self.executemany("INSERT OR IGNORE INTO pending (id) VALUES (?)", [(id,) for id in IDList])
 
+    def clearPending(self, IDList):
+        self.executemany("DELETE FROM pending WHERE id = ?", [(id,) for id in IDList])
 
-def main():
-    #Init
-    response = APICall('items-names', '.json', link = 'https://api.gw2tp.com/1/bulk/')
-    response = response['items']
-    print("Welcome to the Item Crafting Checker! This will see if it is more profitable to craft something with those pesky items, or if you should just sell them!\n")
+    #Drops the recipe information, for users who chose not to store it
+    def clearRecipes(self):
+        with self.lock:
+            for table in ('recipes', 'searched', 'links'):
+                self.connection.execute("DELETE FROM " + table)
 
-    toCheckItems = []
-    skinSet = set()
+    #Wipe every cached item, recipe and currency. Settings (API key, preferences) are kept
+    def clear(self):
+        with self.lock:
+            self.clearRecipes()
+            self.connection.execute("DELETE FROM items")
+            self.connection.execute("DELETE FROM pending")
+            self.connection.execute("DELETE FROM currencies")
 
-    #Create/Maintain the file. It is a dictionary of IDs matched to names and a vendor value. What we grab from the API is a list.
-    try:
-        file = open("itemList.pickle", "rb")
+
+
+#Base for the dictionary-like views onto a CacheStore table
+#Every key goes through int(), a str ID from an old cache or a URL finds the same row as the int the APIs return
+class StoreTable(MutableMapping):
+    def __init__(self, store : CacheStore):
+        self.store = store
+
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(*) FROM " + self.TABLE)[0][0]
+
+    def __iter__(self):
+        return iter([row[0] for row in self.store.execute("SELECT id FROM " + self.TABLE)])
+
+    def __contains__(self, key):
+        try:
+            key = int(key)
+        except (TypeError, ValueError):
+            return False
+        return bool(self.store.execute("SELECT 1 FROM " + self.TABLE + " WHERE id = ?", (key,)))
+
+    def __delitem__(self, key):
+        self.store.execute("DELETE FROM " + self.TABLE + " WHERE id = ?", (int(key),))
+
+    #Bulk upserts go through a single executemany instead of one statement per entry
+    def update(self, other = (), **kwargs):
+        rows = other.items() if hasattr(other, 'items') else other
+        self.store.executemany(self.UPSERT, [self._toRow(int(key), value) for key, value in rows])
+
+
+
+#Named settings, stored as JSON. These used to share the item dictionary under string keys
+class SettingsTable(MutableMapping):
+    def __init__(self, store : CacheStore):
+        self.store = store
+
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(*) FROM settings")[0][0]
+
+    def __iter__(self):
+        return iter([row[0] for row in self.store.execute("SELECT key FROM settings")])
+
+    def __contains__(self, key):
+        return bool(self.store.execute("SELECT 1 FROM settings WHERE key = ?", (key,)))
+
+    def __getitem__(self, key):
+        rows = self.store.execute("SELECT value FROM settings WHERE key = ?", (key,))
+        if not rows:
+            raise KeyError(key)
+        return json.loads(rows[0][0])
+
+    def __setitem__(self, key, value):
+        self.store.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def __delitem__(self, key):
+        self.store.execute("DELETE FROM settings WHERE key = ?", (key,))
+
+
+
+class ItemTable(StoreTable):
+    TABLE = 'items'
+    UPSERT = "INSERT OR REPLACE INTO items (id, name, tp_sell, vendor_value, skin) VALUES (?, ?, ?, ?, ?)"
+
+    def _toRow(self, key, value):
+        return (key, value.name, _boolColumn(value.tradeable), _falseColumn(value.vendorValue), _falseColumn(value.skin))
+
+    def __getitem__(self, key):
+        rows = self.store.execute("SELECT name, tp_sell, vendor_value, skin FROM items WHERE id = ?", (int(key),))
+        if not rows:
+            raise KeyError(key)
+        name, TPSell, vendorValue, skinID = rows[0]
+        return Item(name, _fromBoolColumn(TPSell), _fromFalseColumn(vendorValue), _fromFalseColumn(skinID))
+
+    def __setitem__(self, key, value):
+        self.store.execute(self.UPSERT, self._toRow(int(key), value))
+
+
+
+#The ingredients column holds [[ID, quantity, type], ...] as JSON
+class RecipeTable(StoreTable):
+    TABLE = 'recipes'
+    UPSERT = "INSERT OR REPLACE INTO recipes (id, output_id, output_count, disciplines, min_rating, ingredients) VALUES (?, ?, ?, ?, ?, ?)"
+
+    def _toRow(self, key, value):
+        ingredients = [[ingrd.id, ingrd.count, ingrd.type] for ingrd in value.ingredients]
+        return (key, value.outputID, value.outputCount, json.dumps(value.disciplines), value.rating, json.dumps(ingredients))
+
+    @staticmethod
+    def _fromRow(row):
+        outputID, outputCount, disciplines, rating, ingredients = row
+        return Recipe([Ingredient(*ingrd) for ingrd in json.loads(ingredients)], outputID, outputCount, json.loads(disciplines), rating)
+
+    def __getitem__(self, key):
+        rows = self.store.execute("SELECT output_id, output_count, disciplines, min_rating, ingredients FROM recipes WHERE id = ?", (int(key),))
+        if not rows:
+            raise KeyError(key)
+        return self._fromRow(rows[0])
+
+    def __setitem__(self, key, value):
+        self.store.execute(self.UPSERT, self._toRow(int(key), value))
+
+    #All of the stored recipe IDs that output the given item, straight from the output index
+    def making(self, outputID : int) -> set:
+        return {row[0] for row in self.store.execute("SELECT id FROM recipes WHERE output_id = ?", (outputID,))}
+
+    #One pass over the table instead of a lookup per recipe, in ID order. Streamed off a cursor, so the whole table is never in memory at once
+    def items(self):
+        for row in self.store.iterate("SELECT id, output_id, output_count, disciplines, min_rating, ingredients FROM recipes ORDER BY id"):
+            yield row[0], self._fromRow(row[1:])
+
+
+
+#itemToRecipe. An item only counts as present once we have searched it in at least one direction
+class LinkTable(StoreTable):
+    def __len__(self):
+        return self.store.execute("SELECT COUNT(DISTINCT item_id) FROM searched")[0][0]
+
+    def __iter__(self):
+        return iter([row[0] for row in self.store.execute("SELECT DISTINCT item_id FROM searched")])
+
+    def __contains__(self, key):
+        return bool(self.store.execute("SELECT 1 FROM searched WHERE item_id = ?", (key,)))
+
+    def __getitem__(self, key):
+        searched = {row[0] for row in self.store.execute("SELECT direction FROM searched WHERE item_id = ?", (key,))}
+        if not searched:
+            raise KeyError(key)
+        links = [set() if 0 in searched else None, set() if 1 in searched else None]
+        for direction, recipeID in self.store.execute("SELECT direction, recipe_id FROM links WHERE item_id = ?", (key,)):
+            links[direction].add(recipeID)
+        return links
+
+    #Only the directions that are not None get written, so [None, makes] leaves what we know about 'uses' alone
+    def __setitem__(self, key, value):
+        self.update([(key, value)])
+
+    def __delitem__(self, key):
+        with self.store.lock:
+            self.store.execute("DELETE FROM searched WHERE item_id = ?", (key,))
+            self.store.execute("DELETE FROM links WHERE item_id = ?", (key,))
+
+    #Rebuilds every link from the stored recipes inside SQLite, the same links linkRecipeGraph makes, without loading a single recipe
+    #Only for a full graph: every linked recipe is stored then, so the old links can all go
+    def relink(self):
+        with self.store.lock:
+            self.store.execute("DELETE FROM links")
+            self.store.execute("""INSERT INTO links (item_id, direction, recipe_id)
+                                  SELECT DISTINCT json_extract(ingredient.value, '$[0]'), 0, recipes.id FROM recipes, json_each(recipes.ingredients) AS ingredient
+                                  WHERE json_extract(ingredient.value, '$[2]') = 'Item'""")
+            self.store.execute("INSERT INTO links (item_id, direction, recipe_id) SELECT output_id, 1, id FROM recipes")
+            #Like linkRecipeGraph, an item in any recipe counts as searched both ways, so an item nothing makes is known to have no makers
+            self.store.execute("""INSERT OR IGNORE INTO searched (item_id, direction)
+                                  SELECT DISTINCT item_id, direction.value FROM links, json_each('[0, 1]') AS direction""")
+
+    def update(self, other = (), **kwargs):
+        rows = other.items() if hasattr(other, 'items') else other
+        searched = []
+        links = []
+        for key, value in rows:
+            for direction in (0, 1):
+                if value[direction] is not None:
+                    searched.append((key, direction))
+                    links.extend((key, direction, recipeID) for recipeID in value[direction])
+        with self.store.lock:
+            self.store.executemany("DELETE FROM links WHERE item_id = ? AND direction = ?", searched)
+            self.store.executemany("INSERT OR IGNORE INTO searched (item_id, direction) VALUES (?, ?)", searched)
+            self.store.executemany("INSERT INTO links (item_id, direction, recipe_id) VALUES (?, ?, ?)", links)
+
+
+
+class CurrencyTable(StoreTable):
+    TABLE = 'currencies'
+    UPSERT = "INSERT OR REPLACE INTO currencies (id, name) VALUES (?, ?)"
+
+    def _toRow(self, key, value):
+        return (key, value)
+
+    def __getitem__(self, key):
+        rows = self.store.execute("SELECT name FROM currencies WHERE id = ?", (int(key),))
+        if not rows:
+            raise KeyError(key)
+        return rows[0][0]
+
+    def __setitem__(self, key, value):
+        self.store.execute(self.UPSERT, self._toRow(int(key), value))
+
+
+
+#One-time import of the old pickle cache (item list, then optionally recipeList and itemToRecipe stacked in one file)
+def migratePickle(store : CacheStore, path : str = CONST_CACHE_FILE):
+    with open(path, "rb") as file:
         itemList = pickle.load(file)
-        if response[-1][0] not in itemList:
-            print("One moment while we update the stored items...")
-            toCheckItems.extend(updateItemList(itemList, response))
-        if itemList['recipe']:
+        recipeList = {}
+        itemToRecipe = {}
+        if itemList.get('recipe'):
             try:
                 recipeList = pickle.load(file)
                 itemToRecipe = pickle.load(file)
-            except:
-                recipeList = {}
-                itemToRecipe = {}
-        #If we should prioritize fashion, grab the list of unlocked skins from the API since it has likely changed since last time
-        if itemList['skins']:
-            skinSet = grabSkinInfo(itemList)
-        file.close()
-                
+            except EOFError:
+                pass
+
+    for key in [key for key in itemList if isinstance(key, str) and not key.isdigit()]:
+        store.settings[key] = itemList.pop(key)
+    #Older versions could key items by str, the tables turn those into ints
+    store.items.update((key, Item(*value)) for key, value in itemList.items())
+    store.recipes.update((key, Recipe.fromLists(value)) for key, value in recipeList.items())
+    store.links.update((int(key), value) for key, value in itemToRecipe.items())
+    store.commit()
+
+
+
+#Opens the stored cache. Raises OSError if there is nothing stored yet
+#An old itemList.pickle is moved into the database the first time this runs
+def readFile() -> CacheStore:
+    if not os.path.exists(CONST_CACHE_DB):
+        if not os.path.exists(CONST_CACHE_FILE):
+            raise OSError("No stored item list")
+        print("Moving the stored items over to the new database, this only happens once...")
+        store = CacheStore()
+        migratePickle(store)
+        return store
+    return CacheStore()
+
+
+
+#Everything is written as it arrives, so saving is just a commit
+#If the user chose not to store recipe information, it only lives for this run and gets dropped here
+def writeFile(store : CacheStore):
+    if not store.settings.get('recipe'):
+        store.clearRecipes()
+    store.commit()
+
+
+
+#Compact, read-only form of the full recipe graph for after --sync-graph
+#Everything lives in flat int32 arrays in compressed-sparse-row layout, written once and opened with mmap, so loading costs nothing up front
+#   recipeIDs[r]                                sorted recipe IDs, r is the recipe's row
+#   ingrStart[r] .. ingrStart[r + 1]            the slice of ingrIDs / ingrCounts / ingrTypes holding recipe r's ingredients
+#   outputIDs[r], outputCounts[r]               what recipe r makes
+#   minRatings[r], disciplineMasks[r]           crafting requirements, the mask indexes into the disciplines list in the header (so they come back in that order)
+#   itemIDs[i]                                  sorted IDs of every item in any recipe, i is the item's row
+#   usesStart[i] .. usesStart[i + 1]            the slice of usesRows holding the rows of recipes that use item i
+#   makesStart[i] .. makesStart[i + 1]          the slice of makesRows holding the rows of recipes that make item i
+#File layout is the magic, a uint32 header length, a JSON header (array lengths plus the type / discipline names), then the arrays in the order above
+#The arrays are in native byte order, the file is a local cache and not meant to be moved between machines
+class RecipeGraph:
+    MAGIC = b'GW2CSR01'
+    ARRAYS = ('recipeIDs', 'ingrStart', 'ingrIDs', 'ingrCounts', 'ingrTypes', 'outputIDs', 'outputCounts', 'minRatings', 'disciplineMasks',
+              'itemIDs', 'usesStart', 'usesRows', 'makesStart', 'makesRows')
+
+    def __init__(self, path : str = CONST_GRAPH_FILE):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        view = memoryview(self.map)
+        if view[:8] != self.MAGIC:
+            raise OSError("{} is not a recipe graph file".format(path))
+        headerLength = struct.unpack_from('I', self.map, 8)[0]
+        header = json.loads(bytes(view[12:12 + headerLength]))
+        self.types = header['types']
+        self.disciplines = header['disciplines']
+
+        offset = 12 + headerLength
+        for name in self.ARRAYS:
+            length = header['lengths'][name] * 4
+            setattr(self, name, view[offset:offset + length].cast('i'))
+            offset += length
+
+        self.recipeList = GraphRecipes(self)
+        self.itemToRecipe = GraphLinks(self)
+
+    #Builds the arrays from a recipeList mapping (Recipe ID : Recipe) and writes them to path
+    #The stored RecipeTable streams its recipes in ID order, and the item side is gathered as flat (item, row) pairs and sorted with NumPy,
+    #so nothing but the packed arrays themselves grows with the size of the graph
+    @staticmethod
+    def write(recipeList, path : str = CONST_GRAPH_FILE):
+        import numpy as np
+        types = []
+        disciplines = []
+        arrays = {name : array('i') for name in RecipeGraph.ARRAYS}
+        uses = (array('i'), array('i'))
+        makes = (array('i'), array('i'))
+
+        recipes = recipeList.items() if isinstance(recipeList, RecipeTable) else sorted(recipeList.items())
+        arrays['ingrStart'].append(0)
+        for row, (recipeID, recipe) in enumerate(recipes):
+            arrays['recipeIDs'].append(recipeID)
+            for ingrd in recipe.ingredients:
+                if ingrd.type not in types:
+                    types.append(ingrd.type)
+                arrays['ingrIDs'].append(ingrd.id)
+                arrays['ingrCounts'].append(ingrd.count)
+                arrays['ingrTypes'].append(types.index(ingrd.type))
+                if ingrd.type == 'Item':
+                    uses[0].append(ingrd.id)
+                    uses[1].append(row)
+            arrays['ingrStart'].append(len(arrays['ingrIDs']))
+
+            arrays['outputIDs'].append(recipe.outputID)
+            arrays['outputCounts'].append(recipe.outputCount)
+            makes[0].append(recipe.outputID)
+            makes[1].append(row)
+
+            mask = 0
+            for discipline in recipe.disciplines:
+                if discipline not in disciplines:
+                    disciplines.append(discipline)
+                mask |= 1 << disciplines.index(discipline)
+            arrays['minRatings'].append(recipe.rating)
+            arrays['disciplineMasks'].append(mask)
+
+        #Sorting the pairs by (item, row) lays each item's rows out in a run, in the order the recipes were written
+        itemIDs = np.union1d(np.frombuffer(uses[0], dtype = np.int32), np.frombuffer(makes[0], dtype = np.int32))
+        arrays['itemIDs'] = itemIDs
+        for (pairItems, pairRows), start, rows in ((uses, 'usesStart', 'usesRows'), (makes, 'makesStart', 'makesRows')):
+            pairItems = np.frombuffer(pairItems, dtype = np.int32)
+            pairRows = np.frombuffer(pairRows, dtype = np.int32)
+            order = np.lexsort((pairRows, pairItems))
+            arrays[rows] = pairRows[order]
+            arrays[start] = np.append(np.searchsorted(pairItems[order], itemIDs), len(order)).astype(np.int32)
+
+        header = json.dumps({
+            'lengths' : {name : len(arrays[name]) for name in RecipeGraph.ARRAYS},
+            'types' : types,
+            'disciplines' : disciplines
+        }).encode()
+        #Pad so that every array starts on a 4 byte boundary
+        header += b' ' * (-len(header) % 4)
+
+        #Write to the side and swap in, so a graph that is open elsewhere is never half written
+        with open(path + ".tmp", "wb") as file:
+            file.write(RecipeGraph.MAGIC)
+            file.write(struct.pack('I', len(header)))
+            file.write(header)
+            for name in RecipeGraph.ARRAYS:
+                arrays[name].tofile(file)
+        os.replace(path + ".tmp", path)
+
+    def _row(self, IDs : memoryview, ID : int) -> int:
+        row = bisect_left(IDs, ID)
+        if row < len(IDs) and IDs[row] == ID:
+            return row
+        return -1
+
+    #Returns the Recipe, or None if there is no such recipe
+    def recipe(self, recipeID : int):
+        row = self._row(self.recipeIDs, recipeID)
+        if row < 0:
+            return None
+        start, end = self.ingrStart[row], self.ingrStart[row + 1]
+        ingredients = [Ingredient(self.ingrIDs[i], self.ingrCounts[i], self.types[self.ingrTypes[i]]) for i in range(start, end)]
+        mask = self.disciplineMasks[row]
+        disciplines = [name for bit, name in enumerate(self.disciplines) if mask & (1 << bit)]
+        return Recipe(ingredients, self.outputIDs[row], self.outputCounts[row], disciplines, self.minRatings[row])
+
+    #Recipe IDs that use the item as an ingredient
+    def using(self, itemID : int) -> set:
+        row = self._row(self.itemIDs, itemID)
+        if row < 0:
+            return set()
+        return {self.recipeIDs[r] for r in self.usesRows[self.usesStart[row]:self.usesStart[row + 1]]}
+
+    #Recipe IDs that output the item
+    def making(self, itemID : int) -> set:
+        row = self._row(self.itemIDs, itemID)
+        if row < 0:
+            return set()
+        return {self.recipeIDs[r] for r in self.makesRows[self.makesStart[row]:self.makesStart[row + 1]]}
+
+    def close(self):
+        for name in self.ARRAYS:
+            getattr(self, name).release()
+        self.map.close()
+
+
+
+#recipeList view onto a RecipeGraph
+class GraphRecipes(Mapping):
+    def __init__(self, graph : RecipeGraph):
+        self.graph = graph
+
+    def __getitem__(self, recipeID):
+        recipe = self.graph.recipe(recipeID)
+        if recipe is None:
+            raise KeyError(recipeID)
+        return recipe
+
+    def __contains__(self, recipeID):
+        return self.graph._row(self.graph.recipeIDs, recipeID) >= 0
+
+    def __iter__(self):
+        return iter(self.graph.recipeIDs)
+
+    def __len__(self):
+        return len(self.graph.recipeIDs)
+
+    def making(self, outputID : int) -> set:
+        return self.graph.making(outputID)
+
+
+
+#itemToRecipe view onto a RecipeGraph. The graph is complete, so every item is 'known', most of them just have no recipes
+class GraphLinks(Mapping):
+    def __init__(self, graph : RecipeGraph):
+        self.graph = graph
+
+    def __getitem__(self, itemID):
+        return [self.graph.using(itemID), self.graph.making(itemID)]
+
+    def __contains__(self, itemID):
+        return isinstance(itemID, int)
+
+    def __iter__(self):
+        return iter(self.graph.itemIDs)
+
+    def __len__(self):
+        return len(self.graph.itemIDs)
+
+
+
+#Opens the compact recipe graph if --sync-graph has written one, otherwise returns None
+def readGraph(path : str = CONST_GRAPH_FILE):
+    try:
+        return RecipeGraph(path)
+    except (OSError, ValueError):
+        return None
+
+
+
+#Lookup from typed item names to IDs, so we never have to scan the whole item list
+#   exact       casefolded name : [IDs with that name]  (several items can share a name)
+#   names/IDs   casefolded names sorted, with their IDs alongside, for prefix completion with a binary search
+#   grams       trigram : array of rows into names, for typo-tolerant matching
+#signature is the (number of items, highest ID, renames so far) of the item list it was built from (see CacheStore.itemSignature), so we know when it needs rebuilding
+class NameIndex:
+    def __init__(self, pairs, signature : tuple = None):
+        self.signature = signature
+        self.exact = {}
+        entries = sorted((name.casefold(), id) for id, name in pairs if name)
+        self.names = [entry[0] for entry in entries]
+        self.IDs = array('i', (entry[1] for entry in entries))
+        self.displayNames = {}
+        for id, name in pairs:
+            if name:
+                self.exact.setdefault(name.casefold(), []).append(id)
+                self.displayNames[id] = name
+
+        grams = {}
+        for row, name in enumerate(self.names):
+            for gram in self._grams(name):
+                grams.setdefault(gram, array('i')).append(row)
+        self.grams = grams
+
+    #Trigrams of the name, padded so that the start and end of the name count too
+    @staticmethod
+    def _grams(name : str) -> set:
+        padded = "  " + name + " "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    #IDs of every item with exactly this name, ignoring case
+    def lookup(self, name : str) -> list:
+        return self.exact.get(name.strip().casefold(), [])
+
+    #Up to limit (ID, name) pairs whose name starts with prefix, shortest names first
+    def prefix(self, prefix : str, limit : int = 10) -> list:
+        prefix = prefix.strip().casefold()
+        row = bisect_left(self.names, prefix)
+        matches = []
+        while row < len(self.names) and self.names[row].startswith(prefix) and len(matches) < limit * 20:
+            matches.append((len(self.names[row]), self.IDs[row]))
+            row += 1
+        matches.sort()
+        return [(id, self.displayNames[id]) for _, id in matches[:limit]]
+
+    #Up to limit (ID, name) pairs ranked by how many trigrams they share with the query (Dice coefficient)
+    def fuzzy(self, query : str, limit : int = 10, cutoff : float = 0.3) -> list:
+        queryGrams = self._grams(query.strip().casefold())
+        shared = {}
+        for gram in queryGrams:
+            for row in self.grams.get(gram, ()):
+                shared[row] = shared.get(row, 0) + 1
+
+        scored = []
+        for row, count in shared.items():
+            score = 2 * count / (len(queryGrams) + len(self.names[row]) + 1)
+            if score >= cutoff:
+                scored.append((-score, self.names[row], row))
+        scored.sort()
+        return [(self.IDs[row], self.displayNames[self.IDs[row]]) for _, _, row in scored[:limit]]
+
+    #Ranked suggestions for a name we could not match exactly: prefix matches first, then the closest fuzzy matches
+    def suggest(self, query : str, limit : int = 10) -> list:
+        suggestions = self.prefix(query, limit)
+        seen = {id for id, _ in suggestions}
+        for id, name in self.fuzzy(query, limit):
+            if len(suggestions) >= limit:
+                break
+            if id not in seen:
+                suggestions.append((id, name))
+                seen.add(id)
+        return suggestions
+
+
+
+#Loads the stored name index, rebuilding (and re-storing) it if the item list has changed since it was built
+def readNameIndex(store : CacheStore, path : str = CONST_NAME_INDEX_FILE) -> NameIndex:
+    signature = store.itemSignature()
+    try:
+        with open(path, "rb") as file:
+            index = pickle.load(file)
+        if index.signature == signature:
+            return index
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    index = NameIndex(store.itemNames(), signature)
+    with open(path, "wb") as file:
+        pickle.dump(index, file)
+    return index
+
+
+
+#Brings the stored item list in line with gw2tp's bulk list of item names
+#The bulk file is kept on disk along with its ETag / Last-Modified, so a warm start sends a conditional request and gets back an empty 304
+#New items are found by comparing ID sets (the bulk list is not guaranteed to only grow at the end), and renamed items get their new name
+#Both the download and the diff are streamed, CONST_STREAM_BATCH items at a time, so memory use does not grow with the size of the list
+#Items that are new to an existing list are recorded as pending, so their details can be filled in later in batches of 200 (see enrichPending)
+#Returns the list of new item IDs
+def syncCatalogue(store : CacheStore, path : str = CONST_BULK_FILE) -> list:
+    settings = store.settings
+    headers = {}
+    if os.path.exists(path):
+        if settings.get('catalogueETag'):
+            headers['If-None-Match'] = settings['catalogueETag']
+        if settings.get('catalogueModified'):
+            headers['If-Modified-Since'] = settings['catalogueModified']
+
+    response = transport.get(CONST_BULK_LINK + 'items-names.json', timeout = 30, headers = headers, stream = True, endpoint = 'bulk')
+    #Only a 200 has a body worth reading
+    if response.status_code != 200:
+        response.close()
+    if response.status_code == 200:
+        with response, open(path + ".tmp", "wb") as file:
+            for chunk in response.iter_content(CONST_STREAM_CHUNK):
+                file.write(chunk)
+        os.replace(path + ".tmp", path)
+        settings['catalogueETag'] = response.headers.get('ETag')
+        settings['catalogueModified'] = response.headers.get('Last-Modified')
+    elif response.status_code == 304:
+        #Nothing changed since the last sync. Unless the stored items were cleared since, there is nothing to do
+        if store.itemSignature()[0] >= (settings.get('catalogueCount') or 0) > 0:
+            return []
+    elif os.path.exists(path):
+        print("Could not reach gw2tp for the item list (status {}). Using the copy from last time.".format(response.status_code))
+    else:
+        print("Could not download the item list from gw2tp (status {}). Please try again later.".format(response.status_code))
+        exit(1)
+
+    #On the very first sync everything is new, which is not worth a detail lookup for all of them
+    firstSync = store.itemSignature()[0] == 0
+    newIDs = []
+    count = 0
+
+    #Diff one batch of (ID, name) pairs against what is stored
+    def merge(pairs : list):
+        stored = dict(store.itemNames([pair[0] for pair in pairs]))
+        newItems = [pair for pair in pairs if pair[0] not in stored]
+        store.items.update((id, Item(name)) for id, name in newItems)
+        store.renameItems([pair for pair in pairs if pair[0] in stored and stored[pair[0]] != pair[1]])
+        if not firstSync:
+            store.addPending([pair[0] for pair in newItems])
+            newIDs.extend(pair[0] for pair in newItems)
+
+    with open(path, "rb") as file:
+        pairs = []
+        for pair in iterJSONArray(iter(lambda: file.read(CONST_STREAM_CHUNK), b""), 'items'):
+            pairs.append(pair)
+            count += 1
+            if len(pairs) == CONST_STREAM_BATCH:
+                merge(pairs)
+                pairs = []
+        merge(pairs)
+
+    if firstSync:
+        print("Stored {} items.".format(count))
+    elif newIDs:
+        print("Added {} new items to the stored list.".format(len(newIDs)))
+    settings['catalogueCount'] = count
+    store.commit()
+    return newIDs
+
+
+
+#Fills in the details (trading post status, vendor value, default skin) of items the catalogue sync found, 200 IDs per call
+def enrichPending(store : CacheStore):
+    pending = store.pendingItems()
+    toLookUp = [id for id in pending if id not in store.items or store.items[id].tradeable is None]
+    itemAPICall(toLookUp, store.items)
+    store.clearPending(pending)
+    store.commit()
+
+
+
+#Non-interactive 'sync graph' mode. Builds the complete recipe graph once so that later queries never need recipes/search
+def syncGraphMain():
+    try:
+        store = readFile()
+    except OSError:
+        print("Looks like there's not a stored list of items! One moment while we create this list...\n")
+        store = CacheStore()
+        store.settings['skins'] = False
+        syncCatalogue(store)
+
+    syncRecipeGraph(store.settings, store.recipes, store.links)
+    print("Saving the recipe graph...")
+    writeFile(store)
+    RecipeGraph.write(store.recipes)
+    print("Done! Later searches will not need to call recipes/search.")
+
+
+
+#Everything a search needs that outlives a single search: the stores, the name index, the price cache and the unlocked skins
+#The interactive loop and the server both run searches against one of these. lock is held for the parts of a search that write to the shared stores
+class CrafterState:
+    def __init__(self, store : CacheStore, skinSet : set = None):
+        self.store = store
+        self.settings = store.settings
+        self.itemList = store.items
+        self.currencyDict = store.currencies
+        self.skinSet = skinSet if skinSet is not None else set()
+        self.lock = threading.RLock()
+        #A synced graph is read straight out of the memory-mapped file instead of the database
+        self.graph = readGraph() if self.settings.get('graph') else None
+        if self.graph is not None:
+            self.recipeList, self.itemToRecipe = self.graph.recipeList, self.graph.itemToRecipe
+        else:
+            self.recipeList, self.itemToRecipe = store.recipes, store.links
+        self._nameIndex = None
+        #Set when the refresh found the skins API key no longer works, so the interactive loop can ask for a new one
+        self.needsKey = False
+        #Prices are kept between searches, so related searches (several ores, then their ingots) mostly reuse what we already have
+        self.priceCache = PriceCache()
+        #Order books for --depth, only fetched for the recipes that get a profit curve
+        self.orderBooks = PriceCache(maxSize = CONST_PRICE_CACHE_SIZE // 10, fetch = listingsAPICall, name = 'orderBooks')
+
+    #Read (or rebuilt) on first use, since it is the slowest part of opening the cache
+    @property
+    def nameIndex(self) -> NameIndex:
+        with self.lock:
+            if self._nameIndex is None:
+                self._nameIndex = readNameIndex(self.store)
+            return self._nameIndex
+
+    #Catches the item list up with gw2tp and re-reads the unlocked skins, since they have likely changed since last time
+    #The interactive program runs this in the background, so nothing touches the network before the prompt
+    #Connection problems are reported and otherwise ignored, the cached list is still usable
+    def refresh(self):
+        try:
+            #New items and renamed ones both change the signature, and either way the name index is out of date
+            signature = self.store.itemSignature()
+            syncCatalogue(self.store)
+            if self.store.itemSignature() != signature:
+                with self.lock:
+                    self._nameIndex = None
+            if self.settings.get('skins'):
+                skinSet = grabSkinInfo(self.settings, False)
+                if skinSet is None:
+                    self.needsKey = True
+                else:
+                    self.skinSet = skinSet
+        except OSError as error:
+            print("\nCould not refresh the item list and skins, carrying on with the cached ones ({})".format(type(error).__name__))
+
+    #Wipe the cached items and recipes and start over. Settings (skins, API key, whether to store recipes) survive the clear
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+            syncCatalogue(self.store)
+            self._nameIndex = None
+            #The recipes are gone, so the graph is no longer complete. Run --sync-graph again to rebuild it
+            self.settings['graph'] = False
+            if self.graph is not None:
+                self.graph.close()
+                self.graph = None
+                os.remove(CONST_GRAPH_FILE)
+            self.recipeList, self.itemToRecipe = self.store.recipes, self.store.links
+
+    #Turns what the user typed (an item ID, or a name in any case) into an item ID
+    #Returns the ID, or None along with ranked suggestions if there is no exact match
+    def resolve(self, text : str):
+        text = text.strip()
+        if text.isdigit():
+            return int(text), []
+        matches = self.nameIndex.lookup(text)
+        if matches:
+            return matches[0], []
+        return None, self.nameIndex.suggest(text)
+
+    def itemName(self, itemID : int) -> str:
+        if itemID in self.itemList:
+            return self.itemList[itemID].name
+        return str(itemID)
+
+
+
+#Opens (or on the first run, creates) the stored cache and brings the item list up to date
+#Only the interactive program asks questions. Otherwise a new cache stores recipes and does not track skins
+#An existing cache is opened without any network calls. The interactive program refreshes it in the background, everything else waits for the refresh
+def loadState(interactive : bool = True) -> CrafterState:
+    skinSet = set()
+
+    #Create/Maintain the file. It is a dictionary of IDs matched to names and a vendor value. What we grab from the API is a list.
+    try:
+        state = CrafterState(readFile())
+        if interactive:
+            threading.Thread(target = state.refresh, daemon = True).start()
+        else:
+            state.refresh()
+        return state
     #Create the file if it doesn't exist
     except OSError:
         print("Looks like there's not a stored list of items! \nOne moment while we create this list. It may take a second...\n")
-        file = open("itemList.pickle", "wb")
-        itemList = {}
-        toCheckItems.extend(updateItemList(itemList, response))
-        #The recipe list is accumulated, not initialized. There is too much information to grab and also some auxillary information i.e output name and ingredient names.
-        input = ("Item list complete! Would you like to also store recipe information?\n" + 
-                 "This is HIGHLY recommended. The program will take up more space, but will allow you to use the program more often without being locked out by the GW2 API.\n" + 
-                 "Note: These lists are accumulated. The program may run slow at first, but will rapidly speed up as it gathers more recipe information.\nType yes/no : ")
-        if input.lower() == 'yes' or input.lower() == 'y':
-            itemList['recipe'] = True
+        store = CacheStore()
+        settings = store.settings
+        syncCatalogue(store)
+        if interactive:
+            #The recipe list is accumulated, not initialized. There is too much information to grab and also some auxillary information i.e output name and ingredient names.
+            answer = input("Item list complete! Would you like to also store recipe information?\n" + 
+                           "This is HIGHLY recommended. The program will take up more space, but will allow you to use the program more often without being locked out by the GW2 API.\n" + 
+                           "Note: These lists are accumulated. The program may run slow at first, but will rapidly speed up as it gathers more recipe information.\nType yes/no : ")
+            settings['recipe'] = answer.lower() == 'yes' or answer.lower() == 'y'
+            skinSet = updateSkinAPI(settings)
+        else:
+            settings['recipe'] = True
+            settings['skins'] = False
+        writeFile(store)
+
+    return CrafterState(store, skinSet)
+
+
+
+#Level-by-level walk over the recipe graph, used by both halves of discoverRecipes
+#Nodes are (kind, ID) pairs, i.e. ('recipe', recipe ID) or ('makes', item ID). Each kind is registered with add():
+#   known(ID)       True if the node can be expanded without the API
+#   fetch(IDs)      looks up every unknown node of that kind on the level, in one batched call
+#   expand(ID)      the nodes it leads to on the next level
+#   table           what the metrics call its hit rate
+#A whole level is fetched before any of it is expanded, so the API round trips grow with the depth of the graph rather than its size
+#visited keeps shared ingredients and loops from being expanded twice. maxLevels stops the walk after that many levels, and maxBreadth
+#only expands the first maxBreadth nodes of each level. truncated is set if either limit left something out
+#Walks are run through together(), which can step several of them side by side so a level is fetched once for all of them
+class FrontierWalk:
+    def __init__(self, maxLevels : int = None, maxBreadth : int = None):
+        self.maxLevels = maxLevels
+        self.maxBreadth = maxBreadth
+        self.kinds = {}
+        self.visited = set()
+        self.levels = 0
+        self.truncated = False
+
+    def add(self, kind : str, known, fetch, expand, table : str):
+        self.kinds[kind] = (known, fetch, expand, table)
+
+    #Steps several walks side by side, one level at a time, from their own roots
+    #Every walk expands exactly what it would have on its own, but each level's unknown nodes are fetched once for all of them
+    #The walks must register the same kinds with the same known() and fetch(). Only expand() can differ between them
+    @staticmethod
+    def together(walks : list, roots : list):
+        frontiers = [[node for node in dict.fromkeys(walkRoots) if node not in walk.visited] for walk, walkRoots in zip(walks, roots)]
+        while any(frontiers):
+            frontiers = [walk._enter(frontier) for walk, frontier in zip(walks, frontiers)]
+
+            for kind, (known, fetch, expand, table) in walks[0].kinds.items():
+                IDs = list(dict.fromkeys(id for frontier in frontiers for nodeKind, id in frontier if nodeKind == kind))
+                unknown = [id for id in IDs if not known(id)]
+                metrics.lookup(table, len(IDs) - len(unknown), len(unknown))
+                if unknown:
+                    fetch(unknown)
+
+            frontiers = [walk._expand(frontier) for walk, frontier in zip(walks, frontiers)]
+
+    #Applies the limits to a level and marks what is left of it as visited
+    def _enter(self, frontier : list) -> list:
+        if not frontier:
+            return frontier
+        if self.maxLevels is not None and self.levels >= self.maxLevels:
+            self.truncated = True
+            return []
+        if self.maxBreadth is not None and len(frontier) > self.maxBreadth:
+            frontier = frontier[:self.maxBreadth]
+            self.truncated = True
+        self.visited.update(frontier)
+        self.levels += 1
+        return frontier
+
+    def _expand(self, frontier : list) -> list:
+        nextFrontier = {}
+        for kind, id in frontier:
+            for node in self.kinds[kind][2](id):
+                if node not in self.visited:
+                    nextFrontier[node] = None
+        return list(nextFrontier)
+
+
+
+#Works out every recipe that could use up the items, and everything needed to cost them
+#Several items are walked side by side (see FrontierWalk.together), so each level is fetched once for all of them, and each item still gets
+#exactly the recipes it would have on its own
+#Returns potentials = Item ID : potentialRecipes, toFindInfo (every item we will need a price for) and the IDs of any currencies the recipes use
+#maxDepth caps how many crafting steps are followed up from the items and down from their recipes, maxBreadth how many nodes each level expands (see FrontierWalk)
+def discoverRecipes(state : CrafterState, itemIDs : list, maxDepth : int = None, maxBreadth : int = None):
+    recipeList, itemToRecipe = state.recipeList, state.itemToRecipe
+    #Every crafting step is two levels of the walk: item to recipe, then recipe to item
+    maxLevels = None if maxDepth is None else 2 * maxDepth
+
+    itemIDs = list(dict.fromkeys(itemIDs))
+
+    #Looked up in one batch per level. A synced graph already has every recipe (and can't be written to)
+    def fetchRecipes(recipeIDs : list):
+        returnDict, _ = recipeAPICall(recipeIDs)
+        recipeList.update(returnDict)
+
+    #The search endpoint only takes one ID at a time, so every unknown item on a level is fanned out together. searchAPICall keeps us under the limits
+    def fetchLinks(extension : str, direction : int):
+        def fetch(IDs : list):
+            for id, recipeOutput in recipeSearch(extension, IDs, state.settings).items():
+                links = itemToRecipe[id] if id in itemToRecipe else [None, None]
+                links[direction] = set(recipeOutput)
+                itemToRecipe[id] = links
+        return fetch
+
+    def linked(direction : int):
+        return lambda id: id in itemToRecipe and itemToRecipe[id][direction] is not None
+
+    knownRecipe = lambda recipeID: recipeID in recipeList
+    fetchUsers, fetchMakers = fetchLinks('recipes/search?input=', 0), fetchLinks('recipes/search?output=', 1)
+
+    ##########################################################################################################################################
+    #Walk UP from the item: the recipes that use it, what they make, the recipes that use that, and so on
+    upward = metrics.phase('upward discovery')
+    potentials = {itemID : {} for itemID in itemIDs}
+
+    def usedIn(potentialRecipes : dict):
+        def expand(id : int):
+            if id in itemToRecipe and itemToRecipe[id][0] is not None:
+                for recipeID in itemToRecipe[id][0]:
+                    potentialRecipes[recipeID] = [False]
+                    yield ('recipe', recipeID)
+        return expand
+
+    def outputOf(recipeID : int):
+        if recipeID in recipeList:
+            yield ('uses', recipeList[recipeID].outputID)
+
+    walks = []
+    for itemID in itemIDs:
+        walk = FrontierWalk(maxLevels, maxBreadth)
+        walk.add('uses', linked(0), fetchUsers, usedIn(potentials[itemID]), 'itemToRecipe')
+        walk.add('recipe', knownRecipe, fetchRecipes, outputOf, 'recipeList')
+        walks.append(walk)
+    FrontierWalk.together(walks, [[('uses', itemID)] for itemID in itemIDs])
+    #A recipe the API no longer knows about can't be costed
+    for potentialRecipes in potentials.values():
+        for recipeID in [recipeID for recipeID in potentialRecipes if recipeID not in recipeList]:
+            del potentialRecipes[recipeID]
+    upward.end()
+    
+    #After the walk, we've gone up through every recipe! We have all the potential recipes, recipe info, and item info, so time to return it!
+    #Which potential recipe makes which ingredient is worked out by the CostTable (see CostTable.candidates), so there is no linking to do here
+    ##########################################################################################################################################
+    #Now that we have all the potential recipes, we need to start working back DOWN and grabbing all of the crafting costs
+    #From every potential recipe, walk down: its ingredients, the recipes that make them, their ingredients, and so on
+    #Every level's unknown recipes and unknown makers are looked up together before the walk goes any deeper
+    downward = metrics.phase('downward accumulation')
+    #Kept as dicts so the items shared by several walks are only listed once
+    nonItemInfo = {}
+    toFindInfo = dict.fromkeys(itemIDs)
+    for potentialRecipes in potentials.values():
+        for id in potentialRecipes:
+            toFindInfo[recipeList[id].outputID] = None
+
+    #Each item has its own essential items, so each walk down gets its own expand
+    def ingredientsOf(essentialIDs : set):
+        def expand(recipeID : int):
+            if recipeID not in recipeList:
+                return
+            for ingrd in recipeList[recipeID].ingredients:
+                #If it's not an item, add it to a separate list. It has no recipes or trading post price to look up
+                if ingrd.type != 'Item':
+                    if ingrd.type == "Currency":
+                        nonItemInfo[ingrd.id] = None
+                    continue
+                toFindInfo[ingrd.id] = None
+                #We do not need to look at or touch any recipes that make the 'essential items': items that have the -required- ingredient somewhere down the chain
+                if ingrd.id not in essentialIDs:
+                    yield ('makes', ingrd.id)
+        return expand
+
+    def madeBy(id : int):
+        if id in itemToRecipe and itemToRecipe[id][1] is not None:
+            for recipeID in itemToRecipe[id][1]:
+                yield ('recipe', recipeID)
+
+    walks = []
+    for itemID in itemIDs:
+        #Items that we don't need to check other recipes for since they all use the required ingredient at -some- point
+        essentialIDs = {recipeList[id].outputID for id in potentials[itemID]}
+        walk = FrontierWalk(maxLevels, maxBreadth)
+        walk.add('recipe', knownRecipe, fetchRecipes, ingredientsOf(essentialIDs), 'recipeList')
+        walk.add('makes', linked(1), fetchMakers, madeBy, 'itemToRecipe')
+        walks.append(walk)
+    FrontierWalk.together(walks, [[('recipe', recipeID) for recipeID in potentials[itemID]] for itemID in itemIDs])
+
+    downward.end()
+    return potentials, list(toFindInfo), list(nonItemInfo)
+
+
+
+#Makes sure we have names for every currency in the list. Currency names are stored, so only ones we have never seen need the API
+def lookupCurrencies(state : CrafterState, currencyIDs : list):
+    #currencyDict = ID : name
+    currencyDict = state.currencyDict
+    nonItemInfo = [id for id in set(currencyIDs) if id not in currencyDict]
+
+    while nonItemInfo:
+        strID = truncate(nonItemInfo)
+        outputInfo = APICall('currencies?ids=', strID)
+        for response in outputInfo:
+            currencyDict[response['id']] = response['name']
+
+
+
+#Runs a whole search for one item: discovery, currencies, pricing, costing and ranking
+#Returns a dictionary with the itemID, instantTP, potentialRecipes, itemPriceInfo, costs (the CostTable), recipeProfit and skinRecipes
+#maxDepth and maxBreadth limit the discovery, see discoverRecipes
+#workers is how many processes a big cost evaluation can use (see CostTable). Searches running side by side, like the server's, leave it at 1
+#smooth ranks on the median prices of the last that many days instead of the latest ones (see gatherPrices)
+def searchItem(state : CrafterState, itemID : int, instantTP : bool, maxDepth : int = None, maxBreadth : int = None, workers : int = 1,
+               smooth : float = None) -> dict:
+    #Discovery and pricing write to the shared stores, so only one search does them at a time. Costing and ranking only read
+    with state.lock:
+        potentials, toFindInfo, currencyIDs = discoverRecipes(state, [itemID], maxDepth, maxBreadth)
+        potentialRecipes = potentials[itemID]
+        with metrics.phase('currency lookup'):
+            lookupCurrencies(state, currencyIDs)
+        #Everything the API told us so far is already in the database. Commit it so a crash later on does not lose it
+        state.store.commit()
+        
+        #After the loop, we have all the recipe-related API calls done. 
+        #########################################################################################################################################
+
+        #Now we need to start calculating the cost of everything, churning through it all
+        #Some items will already have their accountbound / soulbound status and vendor value stored in the itemList dictionary
+        #The others we will need to ping '/items' and -then- the commerce info
+        # itemList = ID : Item
+        #itemPriceInfo = ID : [buyCost, sellCost]
+        with metrics.phase('pricing'):
+            itemPriceInfo = gatherPrices(toFindInfo, state.itemList, state.priceCache, smooth)
+        del toFindInfo
+
+    recipeList, itemList = state.recipeList, state.itemList
+    #One bottom-up pass over everything below the potential recipes gives the cheapest cost (and how to get it) for all of them
+    with metrics.phase('cost evaluation'):
+        costs = CostTable(itemID, potentialRecipes, instantTP, itemPriceInfo, recipeList, state.itemToRecipe, workers)
+    for recipeID in potentialRecipes:
+        potentialRecipes[recipeID][0] = costs.recipeCost.get(recipeID, math.inf)
+
+    #Profits for both ways of selling, and the ranking, come out of one vectorized pass
+    #recipeProfit = [[ID, profitBuy, profitSell], ...], already sorted by the user's preference
+    with metrics.phase('ranking'):
+        recipeProfit, noSellIDs = rankRecipes(potentialRecipes, costs.recipeCost, recipeList, itemList, itemPriceInfo, instantTP)
+    for recipeID in noSellIDs:
+        potentialRecipes.pop(recipeID)
+    del noSellIDs
+
+    #If we want to check for skins, then do so now (also making sure the output has a skin)
+    skinRecipes = []
+    if state.settings.get('skins'):
+        for recipeID in potentialRecipes:
+            defaultSkin = itemList[recipeList[recipeID].outputID].skin
+            if defaultSkin and defaultSkin not in state.skinSet:
+                skinRecipes.append(recipeID)
+
+    return {
+        'itemID' : itemID,
+        'instantTP' : instantTP,
+        'potentialRecipes' : potentialRecipes,
+        'itemPriceInfo' : itemPriceInfo,
+        'costs' : costs,
+        'recipeProfit' : recipeProfit,
+        'skinRecipes' : skinRecipes,
+        #Set if any of the answers came out of a cassette instead of the API (see CassetteTransport)
+        'stale' : metrics.staleness()
+    }
+
+
+
+#A plan for crafting one recipe of a search, built once from the cost engine's choices and rendered as text or JSON from the same structure
+#   tree        nested nodes: id, name, count, type, and what to do with it: 'craft' (with the recipe, how many times, and its ingredients),
+#               'buy' (with the unit cost), 'use' for the searched item, 'currency' or 'other'. Counts are already multiplied out by the crafts above them
+#   shopping    everything to buy or pay, totalled over the whole plan: [{id, name, type, count, unitCost}, ...]
+#   steps       every recipe to craft and how many times, ingredients before the recipes that use them
+#   uses        how many of the searched item the plan uses up
+#toJSON adds shoppingCost, the coin spent on the shopping list
+#The shopping list and steps are totalled over the recipe graph rather than the tree, so an intermediate that shows up in several branches is crafted in one go
+#Every node is visited once, off explicit stacks, so big legendary trees neither recurse nor rescan a recipe's ingredients
+class CraftingPlan:
+    def __init__(self, state : 'CrafterState', result : dict, recipeID : int, crafts : int = 1):
+        self.recipeID = recipeID
+        self.crafts = crafts
+        self._state = state
+        self._costs = result['costs']
+        self._itemID = result['itemID']
+        self._names = {}
+        self.tree = self._buildTree()
+        self._total()
+
+    def _name(self, ingredient : Ingredient) -> str:
+        key = (ingredient.type, ingredient.id)
+        if key not in self._names:
+            if ingredient.type == 'Currency':
+                currencyDict = self._state.currencyDict
+                self._names[key] = currencyDict[ingredient.id] if ingredient.id in currencyDict else str(ingredient.id)
+            elif ingredient.type == 'Item':
+                self._names[key] = self._state.itemName(ingredient.id)
+            else:
+                self._names[key] = str(ingredient.id)
+        return self._names[key]
+
+    def _action(self, recipeID : int, ingredient : Ingredient) -> str:
+        if ingredient.type == 'Currency':
+            return 'currency'
+        if ingredient.type != 'Item':
+            return 'other'
+        if ingredient.id == self._itemID:
+            return 'use'
+        return 'buy' if self._costs.choice(recipeID, ingredient.id) is None else 'craft'
+
+    #stack = [(recipe ID, times it is crafted, node list its ingredients go in), ...]
+    def _buildTree(self) -> list:
+        recipeList = self._state.recipeList
+        tree = []
+        stack = [(self.recipeID, self.crafts, tree)]
+        while stack:
+            recipeID, crafts, nodes = stack.pop()
+            for ingredient in recipeList[recipeID].ingredients:
+                node = {'id' : ingredient.id, 'name' : self._name(ingredient), 'count' : ingredient.count * crafts, 'type' : ingredient.type,
+                        'action' : self._action(recipeID, ingredient)}
+                if node['action'] == 'buy':
+                    node['unitCost'] = self._costs.buyCost(ingredient.id)
+                elif node['action'] == 'craft':
+                    nextRecipe = self._costs.choice(recipeID, ingredient.id)
+                    node['recipe'] = nextRecipe
+                    node['crafts'] = math.ceil(node['count'] / recipeList[nextRecipe].outputCount)
+                    node['ingredients'] = []
+                    stack.append((nextRecipe, node['crafts'], node['ingredients']))
+                nodes.append(node)
+        return tree
+
+    #Walks the chosen recipes once for the order, then hands each recipe's demand down to its ingredients, parents first
+    def _total(self):
+        recipeList = self._state.recipeList
+        order = []
+        done = set()
+        stack = [(self.recipeID, False)]
+        while stack:
+            recipeID, expanded = stack.pop()
+            if expanded:
+                order.append(recipeID)
+                continue
+            if recipeID in done:
+                continue
+            done.add(recipeID)
+            stack.append((recipeID, True))
+            for ingredient in recipeList[recipeID].ingredients:
+                if self._action(recipeID, ingredient) == 'craft':
+                    stack.append((self._costs.choice(recipeID, ingredient.id), False))
+
+        #order has every recipe after the recipes it needs, so reversed it has every recipe after the recipes that need it
+        demand = {}
+        craftCount = {self.recipeID : self.crafts}
+        shopping = {}
+        self.uses = 0
+        for recipeID in reversed(order):
+            recipe = recipeList[recipeID]
+            if recipeID not in craftCount:
+                craftCount[recipeID] = math.ceil(demand[recipeID] / recipe.outputCount)
+            for ingredient in recipe.ingredients:
+                count = ingredient.count * craftCount[recipeID]
+                action = self._action(recipeID, ingredient)
+                if action == 'craft':
+                    nextRecipe = self._costs.choice(recipeID, ingredient.id)
+                    demand[nextRecipe] = demand.get(nextRecipe, 0) + count
+                elif action == 'use':
+                    self.uses += count
+                else:
+                    key = (ingredient.type, ingredient.id)
+                    if key not in shopping:
+                        shopping[key] = {'id' : ingredient.id, 'name' : self._name(ingredient), 'type' : ingredient.type, 'count' : 0,
+                                         'unitCost' : self._costs.buyCost(ingredient.id) if action == 'buy' else None}
+                    shopping[key]['count'] += count
+
+        self.shopping = list(shopping.values())
+        self.steps = []
+        for recipeID in order:
+            recipe = recipeList[recipeID]
+            self.steps.append({'recipe' : recipeID, 'output' : recipe.outputID, 'name' : self._state.itemName(recipe.outputID),
+                               'crafts' : craftCount[recipeID], 'makes' : craftCount[recipeID] * recipe.outputCount,
+                               'disciplines' : recipe.disciplines, 'rating' : recipe.rating})
+
+    #Coin spent on the shopping list
+    def cost(self) -> float:
+        return sum(entry['count'] * entry['unitCost'] for entry in self.shopping if entry['type'] == 'Item')
+
+    def toJSON(self) -> dict:
+        return {'crafts' : self.crafts, 'tree' : self.tree, 'shopping' : self.shopping, 'steps' : self.steps, 'uses' : self.uses, 'shoppingCost' : self.cost()}
+
+    #Lines of text: the tree (indented by depth), then the shopping list, then the steps
+    def text(self) -> list:
+        lines = []
+        stack = [(node, 1) for node in reversed(self.tree)]
+        while stack:
+            node, indent = stack.pop()
+            line = "\t" * indent + str(node['count']) + " " + node['name']
+            if node['action'] == 'buy':
+                line += " - Buy off Trading Post for " + _printUnitCost(node['unitCost'], node['count'])
+            elif node['action'] == 'craft':
+                if node['crafts'] != node['count']:
+                    line += " (craft {} times)".format(node['crafts'])
+                stack.extend((child, indent + 1) for child in reversed(node['ingredients']))
+            lines.append(line)
+
+        lines.append("Shopping list:")
+        for entry in self.shopping:
+            if entry['type'] == 'Item':
+                lines.append("\t{} {} - {}".format(entry['count'], entry['name'], _printUnitCost(entry['unitCost'], entry['count'])))
+            else:
+                lines.append("\t{} {}".format(entry['count'], entry['name']))
+        if self.uses:
+            lines.append("\t(and {} of the item you searched for)".format(self.uses))
+        lines.append("Steps:")
+        for number, step in enumerate(self.steps, 1):
+            lines.append("\t{}. Craft {} x{} ({} {})".format(number, step['name'], step['crafts'], "/".join(step['disciplines']), step['rating']))
+        return lines
+
+
+
+def _printUnitCost(unitCost : float, count : int) -> str:
+    if unitCost == math.inf:
+        return "not on the Trading Post"
+    if count == 1:
+        return printCost(unitCost)
+    return printCost(unitCost) + " each, " + printCost(unitCost * count) + " in total"
+
+
+
+#A search result in a form that can go straight to json.dumps. limit caps how many ranked recipes come back
+#With trees, each recipe carries its CraftingPlan for crafting it crafts times. Recipes in curves (see profitCurves) get their profitCurve and bestCrafts
+def resultToJSON(state : CrafterState, result : dict, limit : int = None, trees : bool = True, crafts : int = 1, curves : dict = None) -> dict:
+    recipes = []
+    for recipeID, profitBuy, profitSell in result['recipeProfit'][:limit]:
+        recipe = state.recipeList[recipeID]
+        entry = {
+            'recipe' : recipeID,
+            'output' : recipe.outputID,
+            'name' : state.itemName(recipe.outputID),
+            'outputCount' : recipe.outputCount,
+            'disciplines' : recipe.disciplines,
+            'rating' : recipe.rating,
+            'cost' : result['costs'].recipeCost[recipeID],
+            'vendorOnly' : profitBuy is False,
+            'profitInstant' : None if profitBuy is False else profitBuy,
+            'profitListing' : profitSell
+        }
+        if trees:
+            entry.update(CraftingPlan(state, result, recipeID, crafts).toJSON())
+        if curves and recipeID in curves:
+            entry['profitCurve'] = curves[recipeID]
+            entry['bestCrafts'] = bestBatch(curves[recipeID])
+        recipes.append(entry)
+    return {
+        'item' : result['itemID'],
+        'name' : state.itemName(result['itemID']),
+        'instant' : result['instantTP'],
+        'recipes' : recipes,
+        'skinRecipes' : result['skinRecipes'],
+        'stale' : result.get('stale')
+    }
+
+
+
+#Profit of crafting each recipe n times, for every n in sizes, priced against the order books instead of the top price alone
+#Every size is a CraftingPlan, so the ingredients are the plan's shopping list and shared intermediates are only crafted once
+#In instant mode the ingredients are bought up the sell listings and the output is sold down the buy orders, so the profit per craft falls as n grows
+#Returns curves = Recipe ID : [{crafts, units, cost, revenue, profit}, ...] (revenue after the trading post's cut). A curve stops at the first size the books can't fill
+#The recipes' choices of what to craft and what to buy are still made on the top prices
+def profitCurves(state : CrafterState, result : dict, recipeIDs, sizes = CONST_BATCH_SIZES) -> dict:
+    recipeList, itemList, instantTP = state.recipeList, state.itemList, result['instantTP']
+    plans = {recipeID : [CraftingPlan(state, result, recipeID, crafts) for crafts in sizes] for recipeID in recipeIDs}
+
+    #Every size of a recipe shops for the same items, so the biggest plan has all of them. Fetch every book in one go
+    IDs = {recipeList[recipeID].outputID for recipeID in plans}
+    for recipePlans in plans.values():
+        IDs.update(entry['id'] for entry in recipePlans[-1].shopping if entry['type'] == 'Item')
+    with metrics.phase('order books'):
+        books = state.orderBooks.get(list(IDs))
+
+    curves = {}
+    for recipeID, recipePlans in plans.items():
+        recipe = recipeList[recipeID]
+        output = itemList[recipe.outputID] if recipe.outputID in itemList else Item(None)
+        curves[recipeID] = curve = []
+        for plan in recipePlans:
+            cost = 0
+            for entry in plan.shopping:
+                if entry['type'] == 'Item':
+                    cost += books[entry['id']].costToBuy(entry['count'], instantTP) if entry['id'] in books else math.inf
+            units = plan.crafts * recipe.outputCount
+            if output.tradeable and recipe.outputID in books:
+                revenue = books[recipe.outputID].revenueFromSelling(units, instantTP)
+                revenue = None if revenue is None else revenue * CONST_TP_KEEP
+            else:
+                revenue = units * output.vendorValue if output.vendorValue else None
+            if revenue is None or cost == math.inf:
+                break
+            curve.append({'crafts' : plan.crafts, 'units' : units, 'cost' : cost, 'revenue' : revenue, 'profit' : revenue - cost})
+    return curves
+
+
+
+#The size on a profit curve with the highest total profit, or None for an empty curve
+def bestBatch(curve : list):
+    return max(curve, key = lambda point: point['profit'])['crafts'] if curve else None
+
+
+
+#Prints a finished search in a pretty format. Recipes in curves also get their profit by batch size
+def printResult(state : CrafterState, result : dict, curves : dict = None):
+    itemList, recipeList = state.itemList, state.recipeList
+    itemID, instantTP, itemPriceInfo, costs = result['itemID'], result['instantTP'], result['itemPriceInfo'], result['costs']
+    recipeProfit, skinRecipes = result['recipeProfit'], result['skinRecipes']
+
+    #All info has been gathered. Now to print it in a pretty format!
+    print("API calls, comparisons, and calculations are done!!\n")
+    stale = result.get('stale')
+    if stale:
+        print("NOTE: {} answers were replayed from the cassette, the oldest recorded {} ({} hours ago). Prices may have moved since.\n".format(
+            stale['replayed'], stale['recordedAt'], stale['ageHours']))
+    #If we care about unlocked skins, do those first
+    if skinRecipes:
+        print("First, we found a couple of recipes that make skins you don't own! These are:")
+        for recipeID in skinRecipes:
+            itemName = itemList[recipeList[recipeID].outputID].name
+            print("\t" + itemName + ", which can be crafted for: \t" + printCost(costs.recipeCost[recipeID]))
+        print("\n")
+
+    #Already sorted, just print the relevant reminder
+    if instantTP:
+        print("Sorted by their profit if you were to instant sell the resulting item, they are:")
+    else:
+        print("Sorted by their profit if you were to list the resulting item, they are:")
+    
+    #Only print recipes that we can sell for, even if its at a loss
+    for recipeInfo in recipeProfit:
+        peakRecipeID = recipeInfo[0]
+        outputID = recipeList[peakRecipeID].outputID
+        #Plaintext name, NOT ID anymore since we need to print stuff all nice
+        outputName = itemList[outputID].name
+        #Print a line with the name in the middle to clearly separate items
+        print(outputName.center(40, '-'))
+        #Print discipline and rating requirements
+        print("Requires a level " + str(recipeList[peakRecipeID].rating) + " " + str(recipeList[peakRecipeID].disciplines))
+        if recipeInfo[1] is False:
+            print("Cannot be sold on the Trading Post. It can be sold to a vendor for " + printCost(itemList[outputID].vendorValue) + " and a profit of " + printCost(recipeInfo[2]) + "\n")
+        else:
+            print("Instant sells for " + printCost(itemPriceInfo[outputID][0]) + " and a profit of " + printCost(recipeInfo[1]))
+            print("Lists for " + printCost(itemPriceInfo[outputID][1]) + " and a profit of " + printCost(recipeInfo[2]) +"\n")
+        print(outputName)
+        for line in CraftingPlan(state, result, peakRecipeID).text():
+            print(line)
+        if curves and peakRecipeID in curves:
+            printCurve(curves[peakRecipeID])
+
+        #After printing the crafting tree, newline to separate different items even more
+        print("\n")
+    
+
+
+
+def printCurve(curve : list):
+    if not curve:
+        print("The order books can't fill even a single craft of this.")
+        return
+    print("Profit by batch size, walking the order books:")
+    for point in curve:
+        print("\tx{} ({} made): costs {}, sells for {}, profit {}".format(
+            point['crafts'], point['units'], printCost(round(point['cost'])), printCost(round(point['revenue'])), printCost(round(point['profit']))))
+    if curve[-1]['crafts'] != CONST_BATCH_SIZES[-1]:
+        print("\tThe order books run out after {} crafts.".format(curve[-1]['crafts']))
+    print("Most profitable batch: {} crafts".format(bestBatch(curve)))
+
+
+
+#Everything below a set of recipes, copied out of the stores into plain dictionaries so it can be handed to other processes
+#Returns recipes = Recipe ID : recipe and links = Item ID : [None, {recipe IDs that make the item}], the same shapes as recipeList and itemToRecipe
+def recipeSnapshot(state : CrafterState, rootRecipes) -> tuple:
+    recipeList, itemToRecipe = state.recipeList, state.itemToRecipe
+    recipes = {}
+    links = {}
+    stack = list(rootRecipes)
+    while stack:
+        recipeID = stack.pop()
+        if recipeID in recipes or recipeID not in recipeList:
+            continue
+        recipes[recipeID] = recipeList[recipeID]
+        for ingredient in recipes[recipeID].ingredients:
+            if ingredient.type != 'Item' or ingredient.id in links:
+                continue
+            if ingredient.id in itemToRecipe and itemToRecipe[ingredient.id][1] is not None:
+                makers = set(itemToRecipe[ingredient.id][1])
+            else:
+                makers = recipeList.making(ingredient.id)
+            links[ingredient.id] = [None, makers]
+            stack.extend(makers)
+    return recipes, links
+
+
+
+#Worker side of the process pool. The shared, read-only data arrives once per worker through the initializer
+_workerData = {}
+
+def _initCostWorker(recipes : dict, links : dict, itemPriceInfo : dict):
+    _workerData['recipes'] = recipes
+    _workerData['links'] = links
+    _workerData['itemPriceInfo'] = itemPriceInfo
+
+#Runs the cost engine for one searched item. The table comes back without the shared data attached (see CostTable.__getstate__)
+def _costWorker(task : tuple) -> CostTable:
+    itemID, rootRecipes, instantTP = task
+    return CostTable(itemID, rootRecipes, instantTP, _workerData['itemPriceInfo'], _workerData['recipes'], _workerData['links'])
+
+
+
+#Worker side of CostTable._evaluateLayers. Each worker keeps one shared table, and every batch brings the costs of the recipes it depends on
+def _initLayerWorker(itemID : int, instantTP : bool, itemPriceInfo : dict, recipes : dict, candidates : dict, brokenEdges : set):
+    _workerData['layerTable'] = CostTable.shared(itemID, instantTP, itemPriceInfo, recipes, candidates, brokenEdges)
+
+def _layerWorker(task : tuple) -> list:
+    recipeIDs, known = task
+    table = _workerData['layerTable']
+    table.recipeCost = known
+    table.choices = {}
+    for recipeID in recipeIDs:
+        table._evaluate(recipeID)
+    return [(recipeID, table.recipeCost[recipeID], table.choices[recipeID]) for recipeID in recipeIDs]
+
+
+
+#Reads the items to evaluate from a file, one ID or name per line. Blank lines and lines starting with # are skipped
+def readBatchFile(path : str) -> list:
+    with open(path, encoding = 'utf-8') as file:
+        return [line.strip() for line in file if line.strip() and not line.strip().startswith('#')]
+
+
+
+#Discovery, pricing and costing for a list of items at once, shared by --batch and --account
+#Every item is walked up and down side by side in one discovery, so each level is fetched for all of them at once and each item gets its own
+#recipes straight out of it. Everything is priced in one go, then the cost engine runs for every item on a process pool
+#Returns a searchItem-style result for each item, in the order of itemIDs
+def evaluateItems(state : CrafterState, itemIDs : list, instantTP : bool, workers : int = None, limit : int = None,
+                  maxDepth : int = None, maxBreadth : int = None, smooth : float = None) -> list:
+    print("Discovering recipes for {} items...".format(len(itemIDs)))
+    with state.lock:
+        potentials, toFindInfo, currencyIDs = discoverRecipes(state, itemIDs, maxDepth, maxBreadth)
+        lookupCurrencies(state, currencyIDs)
+        state.store.commit()
+        print("Pricing {} items...".format(len(set(toFindInfo))))
+        itemPriceInfo = gatherPrices(toFindInfo, state.itemList, state.priceCache, smooth)
+
+    #Then the cost engine for every item, spread over the cores. Each worker gets the shared data once
+    allRecipes = set()
+    for potentialRecipes in potentials.values():
+        allRecipes.update(potentialRecipes)
+    recipes, links = recipeSnapshot(state, allRecipes)
+    print("Costing {} items on {} processes...".format(len(itemIDs), workers or os.cpu_count()))
+    tasks = [(itemID, list(potentials[itemID]), instantTP) for itemID in itemIDs]
+    with ProcessPoolExecutor(max_workers = workers, initializer = _initCostWorker, initargs = (recipes, links, itemPriceInfo)) as pool:
+        tables = list(pool.map(_costWorker, tasks, chunksize = max(1, len(tasks) // (4 * (workers or os.cpu_count() or 1)))))
+
+    results = []
+    for itemID, costs in zip(itemIDs, tables):
+        costs.attach(itemPriceInfo, state.recipeList, state.itemToRecipe)
+        potentialRecipes = potentials[itemID]
+        recipeProfit, noSellIDs = rankRecipes(potentialRecipes, costs.recipeCost, state.recipeList, state.itemList, itemPriceInfo, instantTP, limit)
+        results.append({
+            'itemID' : itemID,
+            'instantTP' : instantTP,
+            'potentialRecipes' : potentialRecipes,
+            'itemPriceInfo' : itemPriceInfo,
+            'costs' : costs,
+            'recipeProfit' : recipeProfit,
+            'skinRecipes' : []
+        })
+    return results
+
+
+
+#Non-interactive batch mode. Every item shares one discovery and one pricing phase, then the cost engine runs for all of them on a process pool
+#Results go to outputPath as JSON Lines (one search per line) or CSV (one ranked recipe per row)
+def batchMain(inputPath : str, outputPath : str, outputFormat : str, instantTP : bool, workers : int = None, limit : int = None, trees : bool = False,
+              depth : bool = False, maxDepth : int = None, maxBreadth : int = None, smooth : float = None):
+    state = loadState(interactive = False)
+
+    itemIDs = []
+    for line in readBatchFile(inputPath):
+        itemID, suggestions = state.resolve(line)
+        if itemID is None:
+            print("Skipping '{}', no item with that name. Closest: {}".format(line, ", ".join(name for _, name in suggestions[:3]) or "nothing"))
+        else:
+            itemIDs.append(itemID)
+    itemIDs = list(dict.fromkeys(itemIDs))
+    results = evaluateItems(state, itemIDs, instantTP, workers, limit, maxDepth, maxBreadth, smooth)
+
+    with open(outputPath, 'w', encoding = 'utf-8', newline = '') as file:
+        writer = None
+        if outputFormat == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(['item', 'item_name', 'rank', 'recipe', 'output', 'output_name', 'cost', 'profit_instant', 'profit_listing', 'vendor_only']
+                            + (['best_crafts'] if depth else []))
+
+        for result in results:
+            curves = None
+            if depth:
+                curves = profitCurves(state, result, [recipeID for recipeID, _, _ in result['recipeProfit'][:limit or CONST_CURVE_RECIPES]])
+            output = resultToJSON(state, result, limit, trees, curves = curves)
+            if writer is None:
+                file.write(json.dumps(output) + "\n")
+                continue
+            for rank, recipe in enumerate(output['recipes'], 1):
+                writer.writerow([output['item'], output['name'], rank, recipe['recipe'], recipe['output'], recipe['name'], recipe['cost'],
+                                 recipe['profitInstant'], recipe['profitListing'], recipe['vendorOnly']]
+                                + ([recipe.get('bestCrafts')] if depth else []))
+    writeFile(state.store)
+    print("Wrote results for {} items to {}".format(len(itemIDs), outputPath))
+
+
+
+#Everything the account owns, ID : count, out of the material storage, the bank and every character's bags
+#Returns None if the key can't read them. The characters are fetched side by side, like the recipe searches
+def accountInventory(key : str) -> dict:
+    materials = APICall('account/materials?access_token=', key, ignore = True)
+    bank = APICall('account/bank?access_token=', key, ignore = True)
+    characters = APICall('characters?access_token=', key, ignore = True)
+    if any(type(reply) is int for reply in (materials, bank, characters)):
+        return None
+
+    inventory = {}
+    def add(slots : list):
+        #Empty bank and bag slots come back as null
+        for slot in slots:
+            if slot and slot.get('count'):
+                inventory[slot['id']] = inventory.get(slot['id'], 0) + slot['count']
+
+    add(materials)
+    add(bank)
+    if characters:
+        with ThreadPoolExecutor(max_workers = min(CONST_SEARCH_WORKERS, len(characters))) as pool:
+            replies = pool.map(lambda name: APICall('characters/' + quote(name) + '/inventory?access_token=', key, ignore = True), characters)
+            for reply in replies:
+                if type(reply) is int:
+                    continue
+                for bag in reply['bags']:
+                    if bag:
+                        add(bag['inventory'])
+    return inventory
+
+
+
+#Asks for an API key that can read the account's items, and returns what it owns (see accountInventory), or None if the user gives up
+#The key is stored as the same 'API' setting the skins use
+def updateAccountAPI(settings : 'SettingsTable') -> dict:
+    while True:
+        key = input("\nTo look through your material storage, bank and characters, we need an API key with access to 'inventories' and 'characters'.\n" +
+                    "(If you also prioritize skins, give it 'unlocks' as well, the same key is used for both.)\n" +
+                    "Paste your API key here. To cancel, leave the space empty and press enter : ").strip()
+        if not key:
+            return None
+        inventory = accountInventory(key)
+        if inventory is not None:
+            settings['API'] = key
+            return inventory
+
+
+
+#The best thing to do with every owned item: put it into its most profitable recipe, or sell it as it is
+#A recipe's profit is what it makes from the item (the item itself costs nothing in the cost engine), so it is split over how many of the item
+#its crafting plan uses up, and compared with selling one unit. Only the recipes ranked in the top CONST_CURVE_RECIPES are considered
+#Returns outlets = [{item, name, count, sellValue, recipe, output, uses, perUnit, craft, value}, ...], most valuable first
+def bestOutlets(state : CrafterState, results : list, inventory : dict) -> list:
+    outlets = []
+    for result in results:
+        itemID, instantTP, itemPriceInfo = result['itemID'], result['instantTP'], result['itemPriceInfo']
+        info = state.itemList[itemID] if itemID in state.itemList else Item(None)
+        if info.tradeable and itemID in itemPriceInfo:
+            sellValue = itemPriceInfo[itemID][0 if instantTP else 1] * CONST_TP_KEEP
         else:
-            itemList['recipe'] = False
-        skinSet = updateSkinAPI(itemList)
-        pickle.dump(itemList, file)
-        file.close()
+            sellValue = info.vendorValue or 0
+
+        outlet = {'item' : itemID, 'name' : state.itemName(itemID), 'count' : inventory[itemID], 'sellValue' : sellValue,
+                  'recipe' : None, 'output' : None, 'uses' : None, 'perUnit' : None}
+        for recipeID, profitBuy, profitSell in result['recipeProfit'][:CONST_CURVE_RECIPES]:
+            profit = profitBuy if instantTP and profitBuy is not False else profitSell
+            uses = CraftingPlan(state, result, recipeID).uses or 1
+            if outlet['perUnit'] is None or profit / uses > outlet['perUnit']:
+                outputID = state.recipeList[recipeID].outputID
+                outlet.update(recipe = recipeID, output = state.itemName(outputID), uses = uses, perUnit = profit / uses)
+        outlet['craft'] = outlet['perUnit'] is not None and outlet['perUnit'] > sellValue
+        outlet['value'] = outlet['count'] * (outlet['perUnit'] if outlet['craft'] else sellValue)
+        outlets.append(outlet)
+    outlets.sort(key = lambda outlet: outlet['value'], reverse = True)
+    return outlets
+
+
+
+#Account mode. Reads everything the account owns and works out the best use of all of it in one evaluation, instead of a search per item
+#The item list is refreshed up front, like --batch, so nothing is still writing to the store when the cost processes start
+def accountMain(instantTP : bool, workers : int = None, limit : int = None, maxDepth : int = None, maxBreadth : int = None, smooth : float = None):
+    state = loadState(interactive = False)
+    settings = state.settings
+    #If the refresh found that the stored key stopped working, go straight to asking for a new one
+    inventory = None
+    if settings.get('API') and not state.needsKey:
+        inventory = accountInventory(settings['API'])
+    state.needsKey = False
+    if inventory is None:
+        inventory = updateAccountAPI(settings)
+        if inventory is None:
+            return
+
+    itemIDs = sorted(inventory)
+    print("Found {} different items on the account.".format(len(itemIDs)))
+    results = evaluateItems(state, itemIDs, instantTP, workers, None, maxDepth, maxBreadth, smooth)
+    outlets = bestOutlets(state, results, inventory)
+
+    print("\nThe best use of everything you own, most valuable first ({}):".format("instant buying and selling" if instantTP else "listings"))
+    for outlet in outlets[:limit]:
+        if outlet['craft']:
+            print("{} x{}: craft into {} ({} each), worth {} per item instead of {} selling it. In total {}".format(
+                outlet['name'], outlet['count'], outlet['output'], outlet['uses'], printCost(round(outlet['perUnit'])),
+                printCost(round(outlet['sellValue'])), printCost(round(outlet['value']))))
+        elif outlet['sellValue']:
+            print("{} x{}: sell it as it is for {} each. In total {}".format(
+                outlet['name'], outlet['count'], printCost(round(outlet['sellValue'])), printCost(round(outlet['value']))))
+    writeFile(state.store)
+
+
+
+#Request handler for server mode. Everything is a GET that answers with JSON
+#   /search?item=<ID or name>&instant=<1|0>&limit=<N>&tree=<1|0>&crafts=<N>&depth=<1|0>&maxDepth=<N>&maxBreadth=<N>
+#                                                                   ranked recipes (and crafting plans for N crafts of each, and profit curves) for the item
+#   /suggest?q=<text>                                               ranked name suggestions
+#   /stats                                                          price cache counters, and the metrics since the server started
+class CrafterRequestHandler(BaseHTTPRequestHandler):
+    #Upstream status : (status for the client, message). Anything else is a real upstream failure and becomes a 502
+    API_ERRORS = {
+        403 : (502, 'the Guild Wars 2 API refused the stored API key'),
+        404 : (404, 'the Guild Wars 2 API does not know that item or recipe'),
+        503 : (503, 'the Guild Wars 2 API endpoint is disabled'),
+        CONST_NOT_RECORDED : (503, 'this search was never recorded, so it cannot be replayed from the cassette')
+    }
+
+    def _reply(self, status : int, body : dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        params = {key : values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/search':
+                itemID, suggestions = state.resolve(params.get('item', ''))
+                if itemID is None:
+                    self._reply(404, {'error' : 'item not found', 'suggestions' : [{'id' : id, 'name' : name} for id, name in suggestions]})
+                    return
+                instantTP = params.get('instant', '1') not in ('0', 'false', 'no', 'n')
+                limit = int(params['limit']) if params.get('limit', '').isdigit() else None
+                crafts = int(params['crafts']) if params.get('crafts', '').isdigit() and int(params['crafts']) > 0 else 1
+                maxDepth = int(params['maxDepth']) if params.get('maxDepth', '').isdigit() else None
+                maxBreadth = int(params['maxBreadth']) if params.get('maxBreadth', '').isdigit() else None
+                smooth = int(params['smooth']) if params.get('smooth', '').isdigit() else None
+                result = searchItem(state, itemID, instantTP, maxDepth, maxBreadth, smooth = smooth)
+                curves = None
+                if params.get('depth', '0') not in ('0', 'false', 'no', 'n'):
+                    curves = profitCurves(state, result, [recipeID for recipeID, _, _ in result['recipeProfit'][:limit or CONST_CURVE_RECIPES]])
+                self._reply(200, resultToJSON(state, result, limit, params.get('tree', '1') != '0', crafts, curves))
+            elif url.path == '/suggest':
+                self._reply(200, {'suggestions' : [{'id' : id, 'name' : name} for id, name in state.nameIndex.suggest(params.get('q', ''))]})
+            elif url.path == '/stats':
+                self._reply(200, {'prices' : state.priceCache.stats(), 'metrics' : metrics.summary()})
+            else:
+                self._reply(404, {'error' : 'unknown endpoint'})
+        #An API error is passed on as what it means for this request, and the server keeps serving
+        except APIUnavailable as error:
+            status, message = self.API_ERRORS.get(error.status, (502, 'the Guild Wars 2 API ran into an error'))
+            self._reply(status, {'error' : message, 'status' : error.status})
+        except Exception as error:
+            self._reply(500, {'error' : repr(error)})
+
+    #Keep the console for our own messages instead of a line per request
+    def log_message(self, format, *args):
+        pass
+
+
+
+#Server mode. Loads everything once and keeps it warm, answering searches over a local HTTP/JSON endpoint
+def serveMain(host : str, port : int):
+    state = loadState(interactive = False)
+    server = ThreadingHTTPServer((host, port), CrafterRequestHandler)
+    server.state = state
+    print("Serving searches on http://{}:{}/search?item=... (Ctrl+C to stop)".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        writeFile(state.store)
+
+
+
+#metricsPath, if given, gets a JSON line per search with its API calls, lookups and phase times (see Metrics)
+#With depth, the best CONST_CURVE_RECIPES recipes also get their profit by batch size against the order books
+#maxDepth and maxBreadth limit every search's discovery, see discoverRecipes
+def main(timing : bool = False, metricsPath : str = None, depth : bool = False, maxDepth : int = None, maxBreadth : int = None, workers : int = None,
+         smooth : float = None):
+    #Init
+    print("Welcome to the Item Crafting Checker! This will see if it is more profitable to craft something with those pesky items, or if you should just sell them!\n")
+    mainStart = monotonic()
+    state = loadState()
+    if timing:
+        ready = monotonic()
+        print("Startup took {:.1f} ms: {:.1f} ms importing and setting up, {:.1f} ms opening the cache.\n".format(
+            (ready - startTime) * 1000, (mainStart - startTime) * 1000, (ready - mainStart) * 1000))
 
     
     #Start the while loop that will run until the user exits the program
     while True:
         #Get user input for the item. Bug them until they give us something we can use
-        while success := False != True:
+        success = False
+        while not success:
+            #The background refresh can't ask questions itself
+            if state.needsKey:
+                state.needsKey = False
+                state.skinSet = updateSkinAPI(state.settings)
             item = input("To exit the program, please type 'exit'. If you believe some cached recipe or item data may be incorrect, type 'clear'\n" + 
                          "If you would like to work through the cached items and update their info, type 'cache'\n" + 
                          "\t(Note: The only benefit will be linking skin IDs to items and minor improvements during the commerce section)\n" + 
-                         "Which item do you want to search for? (This is case sensitive, type it as it appears in-game): ")
-            item = item.strip().lower()
-            if item == 'exit':
+                         "Which item do you want to search for? (Type it as it appears in-game, capitals do not matter): ")
+            command = item.strip().lower()
+            if command == 'exit':
                 print("\n\nClearing out cache first. Please do not exit the program, or the accumulated information will not be saved.\n")
-                itemAPICall(toCheckItems, itemList)
+                enrichPending(state.store)
                 print("\n\nNow saving...\n")
+                writeFile(state.store)
                 exit(0)
-            elif item == 'clear':
-                recipeList = {}
-                itemToRecipe = {}
-                haveSkins = itemList['skins']
-                storeRecipes = itemList['recipe']
-                itemList = {}
-                updateItemList(itemList)
-                itemList['skins'] = haveSkins
-                itemList['recipe'] = storeRecipes
-
-            elif item == 'cache':
-                itemAPICall(toCheckItems, itemList)
-
-            #We loop through the inital item list in order to grab the item ID. We must do a slow search like this since all internal / server code uses item IDs, not names.
-            #I did not think it was worth storing a reversed dictionary -just- for this single part of the code.
+            elif command == 'clear':
+                state.clear()
+
+            elif command == 'cache':
+                enrichPending(state.store)
+
+            #Names go through the name index, so this is a single lookup. Several items can share a name, in which case we take the first
+            #If there is no exact match, offer the closest names instead of giving up
             else:
-                for pair in response:
-                    if item == pair[1]:
-                        itemID = str(pair[0])
-                        success = True
-                        break
-                if not success:
-                    print("Sorry, it doesn't look like that item is in our list.")
-                    itemID = input("Do you know the ID of the item? This can be found on the Guild Wars 2 Wiki as the API listing (i.e 46742)\n" 
-                                   + "If you don't know the ID or wish to try again, press Enter : ")
-                    if itemID:
-                        itemInfo = APICall('items/', itemID, True)
-                        if type(itemInfo) is not int:
-                            success = True
-                        else:
-                            print("Could not find that ID. Try the name again.")
+                matches = state.nameIndex.lookup(item)
+                if matches:
+                    itemID = matches[0]
+                    success = True
+                    continue
+
+                print("Sorry, it doesn't look like that item is in our list.")
+                suggestions = state.nameIndex.suggest(item)
+                if suggestions:
+                    print("Did you mean one of these?")
+                    for number, (id, name) in enumerate(suggestions, 1):
+                        print("\t{}. {} (ID {})".format(number, name, id))
+                itemID = input("Type the number of a suggestion, or the ID of the item if you know it. The ID can be found on the Guild Wars 2 Wiki as the API listing (i.e 46742)\n" 
+                               + "If you wish to try again, press Enter : ").strip()
+                if not itemID.isdigit():
+                    continue
+                #Only the numbers on the menu pick a suggestion. Anything else (0 included) is looked up as an item ID
+                if 1 <= int(itemID) <= len(suggestions):
+                    itemID = suggestions[int(itemID) - 1][0]
+                    success = True
+                    continue
+                itemInfo = APICall('items/', itemID, True)
+                if type(itemInfo) is not int:
+                    itemID = int(itemID)
+                    success = True
+                else:
+                    print("Could not find that ID. Try the name again.")
 
         instantTP = True
         while True:
@@ -396,333 +3135,99 @@ def main():
             else:
                 print("Response not recognized. Please respond with just the letter 'y' or 'n'\n")
 
-        
-
-        ##########################################################################################################################################
-        #We now have the itemID and itemInfo from the item itself, so we need to gather all the recipes that USE that item
-        if itemID not in itemToRecipe:
-            itemToRecipe[itemID] = [None, None]
-
-        potentialRecipes = {}
-        recipesToCheck = [itemID]
-        #Keep going until we reach every recipe that has ingredients stemming from the given ID
-        while not recipesToCheck:
-            idsToCheck = []
-            #For every ID we have, we need to grab the recipes that use it as an ingredient
-            for id in recipesToCheck:
-                if id in itemToRecipe and itemToRecipe[id][0] != None:
-                    #If our job is easy, add every recipe in storage to the idsToCheck to look at later
-                    for useID in itemToRecipe[id][0]:
-                        potentialRecipes[useID] = [False, []]
-                        idsToCheck.append(useID)
-                #If our job is not easy, ping the API. Unfortunately, the recipes/search DOES NOT take multiple ids. WE HAVE TO GO ONE BY ONE
-                #WHY IS IT LIKE THIS. WHY MUST I SUFFER. I FUCKING IMPORTED TIME AND DID AN EXTRA CHECK JUST TO BE SURE THAT WE DON'T EXCEED THE LIMITS BECAUSE OH MY GOD WE'RE GOING TO EXCEED THE LIMITS
-                #300 requests per minute. Some base materials (Ancient wood log) would probably hit this limit almost immediately. Especially later when we have to go -DOWN-
-                #Replenishes 5 requests per second. If we go over, we will wait **2** seconds. THIS IS WHY I RECOMMEND SAVING RECIPES AT THE COST OF SPACE.
-                else:
-                    recipeOutput = APICall('recipes/search?input=', id)
-                    #Same thing as above, initialize the cost as False and add to the check list. Now, we also add it to itemToRecipe for future use
-                    if id in itemToRecipe:
-                        itemToRecipe[id] = [set(recipeOutput), itemToRecipe[id][1]]
-                    else:
-                        itemToRecipe[id] = [set(recipeOutput), None]
-                    for recipeID in recipeOutput:
-                        potentialRecipes[recipeID] = [False, []]
-                        idsToCheck.append(recipeID)
-
-            #We now have recipes to check for the output ID (idsToCheck) so that we can continue the loop.
-            recipesToCheck = []
-            if idsToCheck:
-                unknownRecipeIDs = []
-                #If we have the recipe, just grab the output ID and we'll check it later. Otherwise, add it to a list of IDs to call the API for
-                for recipeID in idsToCheck:
-                    if recipeID in recipeList:
-                        recipesToCheck.append(recipeList[recipeID][1][0])
-                    else:
-                        unknownRecipeIDs.append(recipeID)
-                
-                #Go through the IDs until we've checked them all
-                returnDict, returnIDs = recipeAPICall(unknownRecipeIDs)
-                recipeList.update(returnDict)
-                recipesToCheck.extend(returnIDs)
-
-        del recipesToCheck
-        
-        #After the loop, we've gone up through every recipe! We have all the potential recipes, recipe info, and item info, so time to return it!
-        ##########################################################################################################################################
-
-
-        #Re-link the potential recipes so that we can cut down on how many API calls we have to make
-        #For every recipe, check the ingredients and see which recipes create those ingredients
-        for initRecipe in potentialRecipes:
-            for ingredient in recipeList[initRecipe][0]:
-                if ingredient[2] == 'Item':
-                    ingrdID = ingredient[0]
-                    for craftRecipe in potentialRecipes:
-                        #Once we find the correct link, we note it down
-                        if recipeList[craftRecipe][1][0] == ingrdID:
-                            potentialRecipes[initRecipe][1].append(craftRecipe)
-                            
-        
-        ##########################################################################################################################################
-        #Now that we have all the potential recipes, we need to start working back DOWN and grabbing all of the crafting costs
-        #We start by, sadly, going through the recipes we don't know. We make as many API calls as we can at this point to get it out of the way
         print("Beginning recipe accumulation. This may take a moment depending on how many recipes have been stored, if that option was selected.")
-        
-        #For every recipe ID in potentialRecipes we need to look at the ingredients
-        #See if we already have the recipe IDs to make the item. If not, API call
-        #After each loop, gather all recipe IDs that we need to search for and do an API call
-        #Gather info on recipes and then repeat until no more recipes are available
-        nonItemInfo = []
-        toFindInfo = [itemID]
-        IDList = potentialRecipes.keys()
-        #Items that we don't need to check other recipes for since they all use the required ingredient at -some- point
-        essentialIDs = set()
-        for id in IDList:
-            outputItem = recipeList[id][1][0]
-            essentialIDs.add(outputItem)
-            toFindInfo.append(outputItem)
-        while True:
-            checkRecipeList = []
-            unknownRecipes = []
-            #For every recipe, go through the ingredients
-            for recipeID in IDList:
-                #If we don't have the recipe info, we will make a batch call at the end and re-investigate afterwards
-                if recipeID not in recipeList:
-                    unknownRecipes.append(recipeID)
-                else:
-                    for ingrd in recipeList[recipeID][0]:
-                        #If it's not an item, add it to a separate. Otherwise, add it to the cost-checking for later
-                        if ingrd[2] != 'Item': 
-                            if ingrd[2] == "Currency":
-                                nonItemInfo.append(ingrd[0])
-
-                        thisIngredient = ingrd[0]
-                        toFindInfo.append(thisIngredient)
-                        #We do not need to look at or touch any recipes that make the 'essential items': items that have the -required- ingredient somewhere down the chain
-                        if thisIngredient in essentialIDs: 
-                            continue
-
-                        #THEN see if we have the recipes to MAKE that ingredient. If not, API call!
-                        if thisIngredient in itemToRecipe and itemToRecipe[thisIngredient][1] != None:
-                            checkRecipeList.append(itemToRecipe[thisIngredient][1])
-                        else:
-                            #This is only one API call... but oh my god. We have to do it individually. We cannot group up IDs. This alone will cause so many slow downs :C
-                            outputIDs = set(APICall('recipes/search?output=', thisIngredient))
-                            if thisIngredient in itemToRecipe:
-                                itemToRecipe[thisIngredient] = [itemToRecipe[thisIngredient][0], outputIDs]
-                            else:
-                                itemToRecipe[thisIngredient] = [None, outputIDs]
-                            checkRecipeList.extend(outputIDs)
-
-            #Work through the other recipe lists, down the chain
-            IDList = checkRecipeList
-            if not IDList:
-                #If we've gone through all recipes to check AND we don't have any pending recipes, then we can leave
-                if not unknownRecipes:
-                    break
-                else:
-                    #Otherwise we churn through the unknown recipes, gathering info from them, and add them to the queue again to reinvestigate
-                    returnDict, returnIDs = recipeAPICall(unknownRecipes)
-                    recipeList.update(returnDict)
-                    IDList = returnIDs
-
-        #Go through the recipes and collect info on the non-item ingredients (currencies)
-        #currencyDict = ID : name
-        currencyDict = {}
-
-        while nonItemInfo:
-            strID = truncate(nonItemInfo)
-            outputInfo = APICall('currencies?ids=', strID)
-            for response in outputInfo:
-                currencyDict[response['id']] = response['name']
-
-        del nonItemInfo
-        del IDList
-        del essentialIDs
-            
-        
-        #After the loop, we have all the recipe-related API calls done. 
-        #########################################################################################################################################
-
-        print("Now starting the trading post cost accumulation!")
-        #Now we need to start calculating the cost of everything, churning through it all
-        #itemPriceInfo = ID : [buyCost, sellCost]
-        itemPriceInfo = {}
-
-        #Some items will already have their accountbound / soulbound status and vendor value stored in the itemList dictionary
-        #The others we will need to ping '/items' and -then- the commerce info
-        # itemList = ID : [name, can be sold on TP?, vendor value, default skin]
-        APIcommerceIDs = []
-        APIitemIDs = []
-        for potentialID in toFindInfo:
-            #If we have the item info already...
-            if potentialID in itemList and itemList[potentialID][1] != None:
-                #Throw it into the 'commerce' bucket. Then check to see if we have the max number of IDs
-                APIcommerceIDs.append(potentialID)
-            #Otherwise, we will throw it into the 'grab item info' pile
-            else:
-                APIitemIDs.append(potentialID)
-                #Once we can make a max-length call, do so
-                if len(APIitemIDs) == 200:
-                    APIcommerceIDs.extend(itemAPICall(APIitemIDs, itemList))
-        #Finally, clear out the lists one last time to get any remaining IDs
-        APIcommerceIDs.extend(itemAPICall(APIitemIDs, itemList))
-        itemPriceInfo.update(commerceAPICall(APIcommerceIDs))
-
-        del toFindInfo
-        del APIcommerceIDs
-        del APIitemIDs
-
-
-        print("Final recipe cost accumulation running...")
-        #Recursion is the easiest choice here. Looks a bit odd, but given python's whole 'pass-by-reference', we'll be good on space
-        #recipeProfit = [[ID, profitBuy, profitSell], ...]
-        recipeProfit = []
-        skinRecipes = []
-        noSellIDs = []
-
-        #While looping through, keep track of the
-        for recipeID in potentialRecipes:
-            compareCost = recursiveCost(itemID, recipeID, instantTP, itemPriceInfo, recipeList, itemToRecipe, itemList, potentialRecipes)[0]
-            outputID = recipeList[recipeID][0][1]
-
-            #If we want to check for skins, then do so now (also making sure the output has a skin)
-            if itemList['skins']:
-                defaultSkin = itemList[outputID][3]
-                if defaultSkin and defaultSkin not in skinSet:
-                    skinRecipes.append(recipeID)
-
-            #If the output item can be sold on the TP, grab the profit from selling (both instant sell and listing)
-            if itemList[outputID][1]:
-                profitBuy = (itemPriceInfo[outputID][0] * 0.85) - compareCost
-                profitSell = (itemPriceInfo[outputID][1] * 0.85) - compareCost
-                recipeProfit.append([recipeID, profitBuy, profitSell])
-            #If it can only be vendor sold, we want to mark that
-            elif itemList[outputID][2]:
-                profitSell = itemList[outputID][2] - compareCost
-                recipeProfit.append([recipeID, False, profitSell])
-            #If it can't be sold at all, we need to remove it from the final print
-            else:
-                noSellIDs.append(recipeID)
-        
-        for recipeID in noSellIDs:
-            potentialRecipes.pop(recipeID)
-        del noSellIDs
-            
-
-        #########################################################################################################################################
-        
-        #All info has been gathered. Now to print it in a pretty format!
-        print("API calls, comparisons, and calculations are done!!\n")
-        #If we care about unlocked skins, do those first
-        if skinRecipes:
-            print("First, we found a couple of recipes that make skins you don't own! These are:")
-            for recipeID in skinRecipes:
-                itemName = itemList[    recipeList[recipeID][1][0]  ][0]
-                print("\t" + itemName + ", which can be crafted for: \t" + potentialRecipes[recipeID][0])
-            print("\n")
-
-        #Now sort and also print the relevant reminder
-        if instantTP:
-            recipeProfit.sort(reverse=True, key=lambda x: x[1])
-            print("Sorted by their profit if you were to instant sell the resulting item, they are:")
-        else:
-            recipeProfit.sort(reverse=True, key=lambda x: x[2])
-            print("Sorted by their profit if you were to list the resulting item, they are:")
-        
-        #Only print recipes that we can sell for, even if its at a loss
-        for recipeInfo in recipeProfit:
-            peakRecipeID = recipeInfo[0]
-            outputID = recipeList[peakRecipeID][1][0]
-            #Plaintext name, NOT ID anymore since we need to print stuff all nice
-            outputName = itemList[outputID][0]
-            #Print a line with the name in the middle to clearly separate items
-            print(outputName.center(40, '-'))
-            #Print discipline and rating requirements
-            print("Requires a level " + str(recipeList[peakRecipeID][2][1]) + " " + str(recipeList[peakRecipeID][2][0]))
-            if recipeInfo[1] is False:
-                print("Cannot be sold on the Trading Post. It can be sold to a vendor for " + printCost(itemList[outputID][2]) + " and a profit of " + printCost(recipeInfo[2]) + "\n")
-            else:
-                print("Instant sells for " + printCost(itemPriceInfo[outputID][0]) + " and a profit of " + printCost(recipeInfo[1]))
-                print("Lists for " + printCost(itemPriceInfo[outputID][1]) + " and a profit of " + printCost(recipeInfo[2]) +"\n")
-            print(outputName)
-
-            #I did a large-arg recursion once. This one would be even worse. I tried. It needed ~10 args on my initial pass, without completing the code
-            #So we're doing a custom interation method yippeeee
-            #itemIDStack = [[itemID, tabIndent, parentRecipe], ...]
-            itemIDStack = []
-            for ingredient in recipeList[peakRecipeID][0]:
-                itemIDStack.append([ingredient[0], 1, peakRecipeID])
-
-            while itemIDStack:
-                #Grab top of stack and sort relevant info
-                currInfo = itemIDStack.pop()
-                parentRecipeID = currInfo[2]
-                currIndent = currInfo[1]
-                currItem = currInfo[0]
-                
-                #Grab info on the ingredient so we know the type + quantity
-                ingredientInfo = []
-                for ing in recipeList[parentRecipeID][0]:
-                    if ing[0] == currItem:
-                        ingredientInfo = ing
-                
-                #Currencies get printed. They have no recipes or costs so they're quick and easy
-                if ingredientInfo[2] == 'Currency':
-                    currName = currencyDict[currItem]
-                    print("\t" * currIndent + str(ingredientInfo[1]) + " " + currName)
-                    continue
-
-                currName = itemList[currItem][0]
-                #Format: \t's + num of ingredients + name of ingredient (then, if base ingredient) - cost of ingredient on TP
-                #i.e \t\t 5 Mithril Ore - 30c
-                print("\t" * currIndent + str(ingredientInfo[1]) + " " + currName, end = "")
-                nextRecipe : set = itemToRecipe[currItem][1] & potentialRecipes[peakRecipeID][1]
-
-                #If none of the recipes to make the item are in the potentialRecipes bookkeeping...
-                #That means that the cost to craft the item is GREATER than simply buying it off the TP
-                #So, tell the user to buy it off the TP
-                if not nextRecipe:
-                    cost = 0
-                    if instantTP:
-                        cost = itemPriceInfo[currItem][1]
-                    else:
-                        cost = itemPriceInfo[currItem][0]
-                    print(" - Buy off Trading Post for " + printCost(cost))
-                    continue
-
-                #Print statement to add a newline
-                print("")
-                #Otherwise, there's a recipe to use, so add it to the stack (error in case something goes wrong?)
-                if len(nextRecipe) > 1:
-                    raise Exception("nextRecipe has multiple values. We somehow have two recipes to make one item that are the lowest?")
-                
-                #Add all of the ingredients for the found recipe to the stack with a larger indent
-                nextParent = nextRecipe.pop()
-                for ingredient in recipeList[nextParent][0]:
-                    itemIDStack.append([ingredient[0], currIndent + 1, nextParent])
-
-            #After printing the crafting tree, newline to separate different items even more
-            print("\n")
+        metrics.reset()
+        result = searchItem(state, itemID, instantTP, maxDepth, maxBreadth, workers or os.cpu_count() or 1, smooth)
+        stats = state.priceCache.stats()
+        print("Prices: {} reused, {} fetched so far this session.".format(stats['hits'], stats['misses']))
+        curves = None
+        if depth:
+            curves = profitCurves(state, result, [recipeID for recipeID, _, _ in result['recipeProfit'][:CONST_CURVE_RECIPES]])
+        with metrics.phase('printing'):
+            printResult(state, result, curves)
+        if metricsPath:
+            with open(metricsPath, "a") as file:
+                file.write(json.dumps(dict(item = itemID, name = state.itemName(itemID), **metrics.summary())) + "\n")
         
         input("All items have been printed! Press Enter when you are ready to continue...")
 
 
 
-        
-
-        
-        
 
 
 
 
+#argparse type for counts that only make sense above zero, so a 0 is rejected up front instead of quietly meaning "not given"
+def positiveInt(text : str) -> int:
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: '{}'".format(text))
+    if value <= 0:
+        raise argparse.ArgumentTypeError("must be a positive number, not {}".format(value))
+    return value
 
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description = "Find the most profitable way to use a Guild Wars 2 item.")
+    parser.add_argument('--sync-graph', action = 'store_true',
+                        help = "download every recipe in the game and store the full recipe graph, so searches never need recipes/search")
+    parser.add_argument('--score-all', type = positiveInt, metavar = 'N',
+                        help = "score every recipe in the synced graph against current prices and print the best N")
+    parser.add_argument('--listing', action = 'store_true',
+                        help = "with --score-all, --batch or --account, rank by listing instead of instant selling")
+    parser.add_argument('--batch', metavar = 'FILE',
+                        help = "evaluate every item in FILE (one ID or name per line) without any prompts")
+    parser.add_argument('--output', metavar = 'FILE', default = 'results.jsonl', help = "where --batch writes its results")
+    parser.add_argument('--format', choices = ('jsonl', 'csv'), default = 'jsonl', help = "output format for --batch")
+    parser.add_argument('--workers', type = int, help = "processes to cost on (defaults to the core count). Big searches and --score-all split their cost evaluation over them")
+    parser.add_argument('--limit', type = int, help = "with --batch, only keep the best N recipes per item. With --account, only show the N most valuable items")
+    parser.add_argument('--trees', action = 'store_true', help = "with --batch, include crafting trees in the JSON Lines output")
+    parser.add_argument('--max-depth', type = int, metavar = 'N', help = "only follow recipes N crafting steps up from the item and down from its recipes")
+    parser.add_argument('--max-breadth', type = int, metavar = 'N', help = "only expand the first N items or recipes at each step of a search")
+    parser.add_argument('--depth', action = 'store_true',
+                        help = "price the best recipes against the full order books (commerce/listings) and show their profit by batch size")
+    parser.add_argument('--smooth', type = float, nargs = '?', const = CONST_HISTORY_DAYS, metavar = 'DAYS',
+                        help = "rank on the median of the recorded prices over the last DAYS days (default {}) instead of the latest ones".format(CONST_HISTORY_DAYS))
+    parser.add_argument('--account', action = 'store_true',
+                        help = "read everything on the account (API key needed) and work out the best use of all of it in one go")
+    parser.add_argument('--serve', action = 'store_true',
+                        help = "keep everything loaded and answer searches as JSON over a local HTTP endpoint")
+    parser.add_argument('--host', default = '127.0.0.1', help = "address for --serve to listen on")
+    parser.add_argument('--port', type = int, default = 8642, help = "port for --serve to listen on")
+    parser.add_argument('--timing', action = 'store_true', help = "report how long the program took to reach the prompt")
+    parser.add_argument('--metrics', metavar = 'FILE', help = "append a JSON summary of API calls, cache lookups and phase times to FILE after every search")
+    parser.add_argument('--trace', metavar = 'FILE', help = "write every phase and API call to FILE as a Chrome trace when the program ends")
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', dest = 'cassette_mode', action = 'store_const', const = 'record',
+                          help = "save every API answer to the cassette so the same searches can be replayed later")
+    cassette.add_argument('--replay', dest = 'cassette_mode', action = 'store_const', const = 'replay',
+                          help = "answer every API call from the cassette, with no network and no rate limit")
+    cassette.add_argument('--fallback', dest = 'cassette_mode', action = 'store_const', const = 'fallback',
+                          help = "record as usual, but answer from the cassette (marked as stale) while the API is down")
+    parser.add_argument('--cassette', metavar = 'FILE', default = CONST_CASSETTE_FILE, help = "cassette file for --record, --replay and --fallback")
+    args = parser.parse_args()
+    metrics.tracing = bool(args.trace)
+    if args.cassette_mode:
+        transport = CassetteTransport(args.cassette_mode, args.cassette)
+    try:
+        if args.sync_graph:
+            syncGraphMain()
+        elif args.score_all is not None:
+            scoreAllMain(args.score_all, not args.listing, args.workers, args.smooth)
+        elif args.batch:
+            batchMain(args.batch, args.output, args.format, not args.listing, args.workers, args.limit, args.trees, args.depth,
+                      args.max_depth, args.max_breadth, args.smooth)
+        elif args.account:
+            accountMain(not args.listing, args.workers, args.limit, args.max_depth, args.max_breadth, args.smooth)
+        elif args.serve:
+            serveMain(args.host, args.port)
+        else:
+            main(args.timing, args.metrics, args.depth, args.max_depth, args.max_breadth, args.workers, args.smooth)
+    finally:
+        if args.trace:
+            metrics.writeTrace(args.trace)
 
 #response = requests.get('https://api.guildwars2.com/v2/recipes/search')
 #print(response.json())
@@ -752,20 +3257,21 @@ if __name__ == "__main__":
 
 # SAVED INFO
 
-# itemList = ID : [name, can be sold on TP?, vendor value, default skin]
-#	SPECIAL
-#		ItemList['recipe'] = RecipeList exists?
-#		ItemList['skins'] = SkinSet exists?
-# recipeList = Recipe ID : [[list of ingredient IDs, quantity, type], [output ID, quantity], [discipline, rating]]
+# itemList = ID : Item (name, tradeable, vendorValue, skin)
+# settings = name : value
+#		settings['recipe'] = RecipeList exists?
+#		settings['skins'] = SkinSet exists?
+# recipeList = Recipe ID : Recipe (ingredients = [Ingredient (id, count, type), ...], outputID, outputCount, disciplines, rating)
 # itemToRecipe = Item ID : [{list of recipe IDs that use the item}, {list of recipe IDs that make the item}]
 
 # PER - RUN INFO
 
 # skinSet = set of unlocked skins
 # itemPriceInfo = ID : [buyCost, sellCost]
-# potentialRecipes = ID : craftCost, [recipes that make ingredients]
+# potentialRecipes = ID : [craftCost]
 #   Notes: potentialRecipes keeps track of the total cost for that recipe, using the cheapest options on all lower branches.
-#   It will be initialized with every possible recipe. As we work up, cull the more expensive recipes out from the second array
+#   It will be initialized with every possible recipe. The costs are filled in from the CostTable
+# costs = CostTable, see the class for its tables
 # currencyDict = ID : name
 # itemCraftCost = ID : craftCost
 # recipeProfit = [[ID, profitBuy, profitSell], ...]